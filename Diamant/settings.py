@@ -9,6 +9,7 @@ https://docs.djangoproject.com/en/3.2/topics/settings/
 For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
+import json
 import os
 import warnings
 from pathlib import Path
@@ -22,6 +23,24 @@ MEDIA_URL = "/api/media/"
 
 load_dotenv(Path.joinpath(BASE_DIR, ".env"))
 
+# persistent bare mirrors of ingested repositories, least recently used ones are pruned past the size cap
+REPOSITORY_MIRROR_ROOT = Path(os.environ.get("REPOSITORY_MIRROR_ROOT", Path.joinpath(BASE_DIR, "mirrors")))
+REPOSITORY_MIRROR_MAX_BYTES = int(os.environ.get("REPOSITORY_MIRROR_MAX_BYTES", 5 * 1024 ** 3))
+# extracted copy of the bot template repository, one directory per template commit
+TEMPLATE_CACHE_ROOT = Path(os.environ.get("TEMPLATE_CACHE_ROOT", Path.joinpath(BASE_DIR, "template")))
+# large binary artefacts: local disk LRU in front of the shared (database) cache
+ARTEFACT_CACHE_ROOT = Path(os.environ.get("ARTEFACT_CACHE_ROOT", Path.joinpath(BASE_DIR, "artefacts")))
+ARTEFACT_CACHE_MAX_BYTES = int(os.environ.get("ARTEFACT_CACHE_MAX_BYTES", 1024 ** 3))
+ARTEFACT_SHARED_CACHE = os.environ.get("ARTEFACT_SHARED_CACHE", "default")
+# compression of stored code archives: gzip, zstd (needs the zstandard package) or none
+CODE_ARCHIVE_CODEC = os.environ.get("CODE_ARCHIVE_CODEC", "gzip")
+# storage of code archives, see code_manager/storage.py (S3-compatible stores need django-storages and boto3),
+# options are passed to the backend as JSON
+CODE_STORAGE_BACKEND = os.environ.get("CODE_STORAGE_BACKEND", "django.core.files.storage.FileSystemStorage")
+CODE_STORAGE_OPTIONS = json.loads(os.environ.get("CODE_STORAGE_OPTIONS") or "{}")
+# lifetime of the presigned URLs code downloads are redirected to, when the storage supports them
+CODE_DOWNLOAD_URL_EXPIRY = int(os.environ.get("CODE_DOWNLOAD_URL_EXPIRY", 300))
+
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/3.2/howto/deployment/checklist/
 
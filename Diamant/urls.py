@@ -36,5 +36,6 @@ urlpatterns = [
                              path('admin/', admin.site.urls),
                              path('api-auth/', include('rest_framework.urls')),
                              path('oauth/', include('oauth.urls')),
+                             path('code_manager/', include('code_manager.urls')),
                          ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)))
 ]
@@ -0,0 +1,123 @@
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class ArtefactCache:
+    """
+    Two-tier cache for large binary artefacts (template archives, code archives), addressed by the SHA-256 of their
+    content.
+
+    Reads are served from a size-capped LRU directory on local disk, memory mapped instead of copied. Only on a local
+    miss is the artefact fetched from the shared Django cache (a database round trip for DatabaseCache), then kept
+    locally. Content is checked against its hash whenever it is read, corrupt copies are dropped.
+    """
+
+    def __init__(self, root=None, max_bytes: int = None, shared_cache: str = None, key_prefix: str = "artefact:"):
+        self.root = Path(settings.ARTEFACT_CACHE_ROOT if root is None else root)
+        self.max_bytes = settings.ARTEFACT_CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self.shared_cache = caches[settings.ARTEFACT_SHARED_CACHE if shared_cache is None else shared_cache]
+        self.key_prefix = key_prefix
+
+    @staticmethod
+    def digest(data) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def get_path(self, digest: str) -> Path:
+        return self.root.joinpath(digest[:2], digest)
+
+    def put(self, data: bytes) -> str:
+        """
+        Stores `data` in both tiers.
+
+        :return: digest to read the artefact back with
+        """
+        digest = self.digest(data)
+        if f"{self.key_prefix}{digest}" not in self.shared_cache:
+            self.shared_cache.set(f"{self.key_prefix}{digest}", data, timeout=None)
+        self.store_locally(digest, data)
+        return digest
+
+    def store_locally(self, digest: str, data: bytes):
+        path = self.get_path(digest)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # write next to the final location then move it in place, readers never see a partial file
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as temp_file:
+            temp_file.write(data)
+        os.replace(temp_file.name, path)
+        self.prune()
+
+    def read_locally(self, digest: str):
+        """
+        :return: read-only memory map of the local copy (a BytesIO if it is empty, those can't be mapped), None if
+        there is no valid local copy
+        """
+        path = self.get_path(digest)
+        try:
+            with open(path, 'rb') as artefact_file:
+                if os.fstat(artefact_file.fileno()).st_size == 0:
+                    data = b""
+                else:
+                    data = mmap.mmap(artefact_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError:
+            return None
+
+        if self.digest(data) != digest:
+            print(f"dropping corrupt local copy of artefact {digest}")
+            if isinstance(data, mmap.mmap):
+                data.close()
+            path.unlink(missing_ok=True)
+            return None
+        os.utime(path)  # last use, for LRU eviction
+        return data if isinstance(data, mmap.mmap) else io.BytesIO(data)
+
+    @contextmanager
+    def open(self, digest: str):
+        """
+        Yields the artefact as a seekable, read-only file object (usually a memory map, which also supports the buffer
+        protocol), or None if neither tier has a valid copy. It is only valid inside the `with` block.
+        """
+        data = self.read_locally(digest)
+        if data is None:
+            shared_data = self.shared_cache.get(f"{self.key_prefix}{digest}")
+            if shared_data is not None and self.digest(shared_data) == digest:
+                self.store_locally(digest, shared_data)
+                data = self.read_locally(digest)
+                if data is None:  # larger than the whole local tier
+                    data = io.BytesIO(shared_data)
+        try:
+            yield data
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def prune(self):
+        """
+        Deletes least recently used local copies until the local tier fits in `max_bytes`.
+
+        :return: list of deleted paths
+        """
+        entries = []
+        for path in self.root.glob('*/*'):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+
+        deleted = []
+        for _, size, path in sorted(entries):  # oldest first
+            if total_size <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)  # open memory maps stay valid after the unlink
+            total_size -= size
+            deleted.append(path)
+        return deleted
@@ -0,0 +1,78 @@
+import os
+from datetime import timedelta
+
+from django.utils import timezone
+
+from game_engine.models import UserCode
+
+BLOB_DIRECTORY = "blobs"
+
+
+def get_blob_name(content_hash: str, extension: str = "tar") -> str:
+    return f"{BLOB_DIRECTORY}/{content_hash[:2]}/{content_hash}.{extension}"
+
+
+def store_blob(storage, content_hash: str, write, extension: str = "tar") -> str:
+    """
+    Stores content under its hash, only calling `write` if no blob with that hash exists yet, so identical code
+    (e.g. the bot template given to every new user, or a branch pushed unchanged) is written and kept once.
+
+    :param storage: Django storage backend, usually `UserCode.source_code.storage`
+    :param content_hash: hash identifying the content
+    :param write: callable(storage, name) writing the content to `name` and returning the name actually saved
+    :param extension: blob file extension
+    :return: storage name of the blob
+    """
+    name = get_blob_name(content_hash, extension)
+    if storage.exists(name):
+        # an old unreferenced blob being reused must not look collectable until its UserCode is saved
+        return touch_blob(storage, name, write)
+    return write(storage, name)
+
+
+def touch_blob(storage, name: str, write) -> str:
+    """
+    Resets the age `collect_garbage` sees for a blob. Storages without local paths (object stores) can't update a
+    modified time in place, the blob is written again instead.
+
+    :return: storage name of the blob
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        return write(storage, name)
+    os.utime(path)
+    return name
+
+
+def list_blobs(storage):
+    if not storage.exists(BLOB_DIRECTORY):
+        return []
+    blobs = []
+    for prefix in storage.listdir(BLOB_DIRECTORY)[0]:
+        blobs.extend(f"{BLOB_DIRECTORY}/{prefix}/{filename}"
+                     for filename in storage.listdir(f"{BLOB_DIRECTORY}/{prefix}")[1])
+    return blobs
+
+
+def collect_garbage(storage, grace_period: timedelta = timedelta(hours=1)):
+    """
+    Deletes blobs no UserCode points to any more. Blobs younger than `grace_period` are kept, as they may have been
+    stored (or reused, see `touch_blob`) by an ingestion that hasn't saved its UserCode yet.
+
+    :return: list of deleted blob names
+    """
+    referenced = set(UserCode.objects.filter(source_code__startswith=f"{BLOB_DIRECTORY}/")
+                     .values_list('source_code', flat=True))
+    cutoff = timezone.now() - grace_period
+
+    deleted = []
+    for name in list_blobs(storage):
+        if name in referenced or storage.get_modified_time(name) > cutoff:
+            continue
+        # `referenced` may be stale by now, a code saved since could point to the blob
+        if UserCode.objects.filter(source_code=name).exists():
+            continue
+        storage.delete(name)
+        deleted.append(name)
+    return deleted
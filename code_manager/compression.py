@@ -0,0 +1,100 @@
+import io
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # optional, only needed for CODE_ARCHIVE_CODEC=zstd
+    zstandard = None
+
+CHUNK_SIZE = 64 * 1024
+
+# codec -> (blob file extension, HTTP content coding)
+CODECS = {
+    'none': ('tar', None),
+    'gzip': ('tar.gz', 'gzip'),
+    'zstd': ('tar.zst', 'zstd'),
+}
+
+
+def get_codec(codec: str = None) -> str:
+    """
+    :param codec: codec name, defaults to settings.CODE_ARCHIVE_CODEC
+    :raises ImproperlyConfigured: if the codec is unknown or its library isn't installed
+    """
+    codec = settings.CODE_ARCHIVE_CODEC if codec is None else codec
+    if codec not in CODECS:
+        raise ImproperlyConfigured(f"unknown code archive codec {codec}, expected one of {', '.join(CODECS)}")
+    if codec == 'zstd' and zstandard is None:
+        raise ImproperlyConfigured("the zstd code archive codec needs the zstandard package")
+    return codec
+
+
+def get_extension(codec: str) -> str:
+    return CODECS[codec][0]
+
+
+def get_content_encoding(codec: str):
+    return CODECS[codec][1]
+
+
+def compressor(codec: str):
+    if codec == 'gzip':
+        return zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container rather than raw zlib
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor().compressobj()
+    return None
+
+
+def decompressor(codec: str):
+    if codec == 'gzip':
+        return zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return None
+
+
+class CompressingReader(io.RawIOBase):
+    """
+    Read-only, non-seekable file object compressing `source` as it is read, so a stream (e.g. `git archive` output)
+    can be handed to a storage backend compressed without first being buffered anywhere.
+    """
+
+    def __init__(self, source, codec: str):
+        super().__init__()
+        self.source = source
+        self.compressor = compressor(codec)
+        self.buffer = b""
+        self.finished = False
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.buffer and not self.finished:
+            chunk = self.source.read(CHUNK_SIZE)
+            if self.compressor is None:
+                self.buffer, self.finished = chunk, not chunk
+            elif chunk:
+                self.buffer = self.compressor.compress(chunk)
+            else:
+                self.buffer, self.finished = self.compressor.flush(), True
+
+        size = min(len(buffer), len(self.buffer))
+        buffer[:size] = self.buffer[:size]
+        self.buffer = self.buffer[size:]
+        return size
+
+
+def decompress_chunks(source, codec: str):
+    """
+    Yields the decompressed content of the file object `source` chunk by chunk, closing `source` once done.
+    """
+    decompress = decompressor(codec)
+    with source:
+        while chunk := source.read(CHUNK_SIZE):
+            yield decompress.decompress(chunk) if decompress is not None else chunk
+        if decompress is not None and hasattr(decompress, 'flush'):
+            yield decompress.flush()
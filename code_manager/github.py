@@ -0,0 +1,181 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class GitHubClient:
+    """
+    Shared client for the GitHub API and OAuth endpoints.
+
+    - Connections are pooled and reused across requests and threads, every request has a timeout.
+    - `get_pages` sends the ETag of each list page it saw before in If-None-Match. Unchanged pages come back as an
+      empty 304, which GitHub doesn't count against the rate limit, and are served from memory. Only the last page
+      of a list is always downloaded.
+    - The rate limit budget reported in X-RateLimit-* headers is tracked per token, requests wait for the reset once
+      it runs low, and rate limited requests are retried with exponential backoff. Requests made with `wait=False`
+      (e.g. while serving a web request) never wait nor retry.
+
+    The transport is anything with the `requests.Session.request` signature, so a local fake can stand in for GitHub.
+    """
+    api_url = "https://api.github.com"
+    max_retries = 3
+    backoff = 1  # seconds, doubled on every retry
+
+    def __init__(self, transport=None, timeout: float = None, min_remaining: int = None, max_wait: float = None,
+                 max_cached_pages: int = 1000, sleep=time.sleep):
+        """
+        :param transport: defaults to a pooled requests.Session
+        :param timeout: seconds per request, defaults to GITHUB_API_TIMEOUT (30)
+        :param min_remaining: requests kept in reserve before waiting for the rate limit reset, defaults to
+            GITHUB_API_MIN_REMAINING (50)
+        :param max_wait: longest wait for a rate limit reset or retry in seconds, defaults to GITHUB_API_MAX_WAIT (60)
+        :param max_cached_pages: number of list pages, and of token budgets, kept
+        """
+        if transport is None:
+            transport = requests.Session()
+            pool_size = max(int(os.environ.get("INGESTION_WORKERS", 4)), 10)
+            transport.mount("https://", HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size))
+        self.transport = transport
+        self.timeout = float(os.environ.get("GITHUB_API_TIMEOUT", 30)) if timeout is None else timeout
+        self.min_remaining = int(os.environ.get("GITHUB_API_MIN_REMAINING", 50)) \
+            if min_remaining is None else min_remaining
+        self.max_wait = float(os.environ.get("GITHUB_API_MAX_WAIT", 60)) if max_wait is None else max_wait
+        self.max_cached_pages = max_cached_pages
+        self.sleep = sleep
+
+        self.lock = threading.Lock()
+        self.budgets = OrderedDict()  # token hash -> (remaining, reset_at), least recently used first
+        self.pages = OrderedDict()  # (url, token hash) -> (ETag, JSON body, next page URL), least recently used first
+
+    @staticmethod
+    def get_headers(token=None, headers=None):
+        request_headers = {'Accept': "application/vnd.github.v3+json"}
+        if token is not None:
+            request_headers['Authorization'] = f"token {token}"
+        request_headers.update(headers or {})
+        return request_headers
+
+    @staticmethod
+    def token_key(token=None):
+        return hashlib.sha256((token or "").encode()).hexdigest()
+
+    def update_rate_limit(self, token_key, response):
+        try:
+            remaining = int(response.headers['X-RateLimit-Remaining'])
+            reset_at = float(response.headers['X-RateLimit-Reset'])
+        except (KeyError, ValueError):
+            return
+        with self.lock:
+            self.budgets[token_key] = (remaining, reset_at)
+            self.budgets.move_to_end(token_key)
+            while len(self.budgets) > self.max_cached_pages:
+                self.budgets.popitem(last=False)
+
+    def wait_for_budget(self, token_key):
+        # every token (the org's, each user's OAuth token) has a budget of its own
+        with self.lock:
+            remaining, reset_at = self.budgets.get(token_key, (None, None))
+        if remaining is None or remaining > self.min_remaining:
+            return
+        if (wait := reset_at - time.time()) > 0:
+            print(f"GitHub rate limit budget low ({remaining} left), waiting {min(wait, self.max_wait):.0f}s")
+            self.sleep(min(wait, self.max_wait))
+
+    @staticmethod
+    def rate_limited(response):
+        return response.status_code == 429 or \
+            (response.status_code == 403 and (response.headers.get('X-RateLimit-Remaining') == '0'
+                                              or 'Retry-After' in response.headers))
+
+    def request(self, method, url, token=None, headers=None, wait=True, **kwargs):
+        """
+        :param token: token to authenticate with, if any
+        :param wait: whether to wait for the rate limit budget and retry rate limited requests, a single attempt is
+            made otherwise
+        :return: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        headers = self.get_headers(token, headers)
+        token_key = self.token_key(token)
+        for attempt in range(self.max_retries + 1):
+            if wait:
+                self.wait_for_budget(token_key)
+            response = self.transport.request(method, url, headers=headers, **kwargs)
+            self.update_rate_limit(token_key, response)
+            if not wait or not self.rate_limited(response) or attempt == self.max_retries:
+                return response
+
+            try:
+                wait = float(response.headers['Retry-After'])
+            except (KeyError, ValueError):
+                wait = self.backoff * 2 ** attempt
+            print(f"rate limited by GitHub on {url}, retrying in {min(wait, self.max_wait):.0f}s")
+            self.sleep(min(wait, self.max_wait))
+        return response
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def get_page(self, url, token=None, params=None):
+        """
+        Conditional GET of one JSON list page.
+
+        :return: 2-tuple: (JSON body, URL of the next page or None)
+        """
+        prepared_url = requests.Request('GET', url, params=params).prepare().url
+        key = (prepared_url, self.token_key(token))
+        with self.lock:
+            cached = self.pages.get(key)
+        # the last page is always fetched: items appended to a full last page only show up as a new Link header,
+        # which doesn't change its ETag
+        headers = {'If-None-Match': cached[0]} if cached is not None and cached[2] is not None else None
+
+        response = self.get(prepared_url, token=token, headers=headers)
+        if response.status_code == 304 and cached is not None:
+            with self.lock:
+                self.pages.move_to_end(key)
+            return cached[1], cached[2]
+        response.raise_for_status()
+
+        body, next_url = response.json(), response.links.get("next", {}).get("url")
+        if etag := response.headers.get('ETag'):
+            with self.lock:
+                self.pages[key] = (etag, body, next_url)
+                self.pages.move_to_end(key)
+                while len(self.pages) > self.max_cached_pages:
+                    self.pages.popitem(last=False)
+        return body, next_url
+
+    def get_pages(self, url, token=None, params=None):
+        """
+        :return: items of every page of a paginated list endpoint
+        """
+        items = []
+        while url is not None:
+            body, url = self.get_page(url, token=token, params=params)
+            items.extend(body)
+            params = None  # next page links carry the query string
+        return items
+
+
+client_lock = threading.Lock()
+client = None
+
+
+def get_client() -> GitHubClient:
+    """
+    :return: the process wide client, so pooled connections and cached pages outlive a single task run
+    """
+    global client
+    with client_lock:
+        if client is None:
+            client = GitHubClient()
+        return client
@@ -0,0 +1,41 @@
+import os
+from urllib.parse import quote
+
+from code_manager.github import GitHubClient, get_client
+
+
+class GitHubContentsSource:
+    """
+    Reads identity file candidates through the GitHub contents API: one request lists the top level of the
+    repository, then only the files actually parsed are downloaded, instead of cloning the whole repository.
+
+    Any object with the same `candidate_files` and `read_file` methods can be used in its place, e.g. to look files up
+    locally in tests.
+    """
+    max_file_size = 1024  # identity files are a couple of lines, skip over anything larger
+
+    def __init__(self, access_token: str = None, client: GitHubClient = None):
+        self.access_token = os.environ.get("GITHUB_API_TOKEN") if access_token is None else access_token
+        self.client = get_client() if client is None else client
+
+    def get(self, repo, path, accept="application/vnd.github.v3+json"):
+        return self.client.get(f"{self.client.api_url}/repos/{repo['full_name']}/contents/{quote(path)}",
+                               token=self.access_token, headers={'Accept': accept},
+                               params={'ref': repo['default_branch']} if repo.get('default_branch') else None)
+
+    def candidate_files(self, repo):
+        """
+        :param repo: repository dict from the GitHub API
+        :return: names of the small files at the top level of `repo`
+        """
+        res = self.get(repo, "")
+        if res.status_code == 404:  # empty repository
+            return []
+        res.raise_for_status()
+        return [entry['name'] for entry in res.json()
+                if entry['type'] == 'file' and entry['size'] < self.max_file_size]
+
+    def read_file(self, repo, name) -> str:
+        res = self.get(repo, name, accept="application/vnd.github.v3.raw")
+        res.raise_for_status()
+        return res.text
@@ -0,0 +1,34 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:38
+
+from django.db import migrations, models
+import jsonfield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('code_manager', '0003_auto_20210716_1200'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='branch_heads',
+            field=jsonfield.fields.JSONField(default=dict),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='clone_url',
+            field=models.CharField(max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='last_synced',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='repository',
+            name='pushed_at',
+            field=models.DateTimeField(null=True),
+        ),
+    ]
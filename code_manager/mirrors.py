@@ -0,0 +1,143 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from git import Git, Repo
+
+
+def get_authenticated_url(repo_url: str) -> str:
+    # cloning of private repository possible by providing <username>:<personal access token> pair
+    # use https://<username>:<personal access token>@github.com/repo_owner/repo_name
+    return f"{os.environ['GITHUB_API_TOKEN_USER']}:{os.environ.get('GITHUB_API_TOKEN')}@github.com/".join(
+        repo_url.split("github.com/")
+    )
+
+
+def get_mirror_path(repo_url: str) -> Path:
+    repo_name = repo_url.rstrip('/').split('/')[-1].split('.git')[0]
+    url_hash = hashlib.sha1(repo_url.encode()).hexdigest()[:16]
+    return Path(settings.REPOSITORY_MIRROR_ROOT).joinpath(f"{repo_name}-{url_hash}.git")
+
+
+@contextmanager
+def mirror_lock(mirror_path: Path, blocking=True, shared=False, suffix="lock"):
+    """
+    Lock on a mirror, held across threads and processes (ingestion workers, celery workers). `<mirror>.lock` is held
+    exclusively while a mirror is written, `<mirror>.use` shared while it is read, see `mirror_in_use`.
+
+    :raises BlockingIOError: if `blocking` is False and the mirror is locked
+    """
+    mirror_path.parent.mkdir(parents=True, exist_ok=True)
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    with open(f"{mirror_path}.{suffix}", 'w') as lock_file:
+        fcntl.flock(lock_file, operation if blocking else operation | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def mirror_in_use(repo_url: str):
+    """
+    Keeps the mirror of `repo_url` from being pruned while the block reads it, e.g. `git archive` on the Repo
+    returned by `update_mirror`, which only locks the mirror while updating it. Any number of readers can hold it.
+    """
+    return mirror_lock(get_mirror_path(repo_url), shared=True, suffix="use")
+
+
+def update_mirror(repo_url: str, timeout: float = None) -> Repo:
+    """
+    Brings the bare mirror of `repo_url` up to date, creating it on first use. Existing mirrors only fetch the objects
+    they are missing, so a repository that hasn't changed costs a single round trip.
+
+    :param repo_url: https clone URL of the repository, used as the mirror key
+    :param timeout: seconds after which a clone/fetch is killed, defaults to INGESTION_CLONE_TIMEOUT
+    :return: Repo instance of the bare mirror, branches are under refs/heads
+    """
+    if timeout is None:
+        timeout = float(os.environ.get("INGESTION_CLONE_TIMEOUT", 300))
+    mirror_path = get_mirror_path(repo_url)
+    auth_url = get_authenticated_url(repo_url)
+
+    with mirror_lock(mirror_path):
+        if mirror_path.joinpath('HEAD').exists():
+            print(f"fetching {repo_url} into mirror")
+            Git(mirror_path).execute(['git', 'fetch', '--prune', '--force', '--', auth_url,
+                                      '+refs/heads/*:refs/heads/*'], kill_after_timeout=timeout)
+            Git(mirror_path).execute(['git', 'gc', '--auto', '--quiet'])
+        else:
+            print(f"cloning repo {repo_url} into mirror")
+            # clone next to the final location then move it in place, so a killed clone never looks like a mirror
+            with tempfile.TemporaryDirectory(dir=mirror_path.parent) as temp_dir:
+                temp_mirror = os.path.join(temp_dir, 'mirror.git')
+                Git().execute(['git', 'clone', '--bare', '--', auth_url, temp_mirror], kill_after_timeout=timeout)
+                Git(temp_mirror).execute(['git', 'remote', 'set-url', 'origin', repo_url])  # don't keep the token
+                shutil.rmtree(mirror_path, ignore_errors=True)
+                os.rename(temp_mirror, mirror_path)
+
+        os.utime(mirror_path)  # last use, for LRU eviction
+        return Repo(mirror_path)
+
+
+def get_remote_heads(repo_url: str, timeout: float = None) -> dict:
+    """
+    Reads the branch heads of `repo_url` without fetching any objects.
+
+    :return: dict: branch name -> head commit SHA
+    """
+    if timeout is None:
+        timeout = float(os.environ.get("INGESTION_CLONE_TIMEOUT", 300))
+    output = Git().execute(['git', 'ls-remote', '--heads', '--', get_authenticated_url(repo_url)],
+                           kill_after_timeout=timeout)
+    heads = {}
+    for line in output.splitlines():
+        sha, ref = line.split('\t')
+        heads[ref[len('refs/heads/'):]] = sha
+    return heads
+
+
+def get_directory_size(path) -> int:
+    size = 0
+    for parent_path, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(parent_path, filename)).st_size
+            except FileNotFoundError:
+                pass
+    return size
+
+
+def prune_mirrors(max_bytes: int = None):
+    """
+    Deletes least recently used mirrors until the mirror directory fits in `max_bytes`. Mirrors being updated or read
+    (see `mirror_in_use`) are skipped.
+
+    :param max_bytes: size cap, defaults to settings.REPOSITORY_MIRROR_MAX_BYTES
+    :return: list of deleted mirror paths
+    """
+    max_bytes = settings.REPOSITORY_MIRROR_MAX_BYTES if max_bytes is None else max_bytes
+    mirror_root = Path(settings.REPOSITORY_MIRROR_ROOT)
+    if not mirror_root.exists():
+        return []
+
+    mirrors = sorted((path for path in mirror_root.glob('*.git') if path.is_dir()), key=lambda p: p.stat().st_mtime)
+    sizes = {mirror: get_directory_size(mirror) for mirror in mirrors}
+    total_size = sum(sizes.values())
+
+    deleted = []
+    for mirror in mirrors:  # oldest first
+        if total_size <= max_bytes:
+            break
+        try:
+            with mirror_lock(mirror, blocking=False, suffix="use"), mirror_lock(mirror, blocking=False):
+                shutil.rmtree(mirror)
+        except BlockingIOError:
+            continue
+        total_size -= sizes[mirror]
+        deleted.append(mirror)
+    return deleted
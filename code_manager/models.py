@@ -1,7 +1,16 @@
 from django.db import models
 from game_engine.models import User
 
+from jsonfield import JSONField
+
+
 # Create your models here.
 class Repository(models.Model):
     name = models.CharField(max_length=120)
     owner = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    # sync metadata, lets ingestion skip repositories that haven't changed without cloning them
+    clone_url = models.CharField(max_length=255, unique=True, null=True)
+    pushed_at = models.DateTimeField(null=True)
+    branch_heads = JSONField(default=dict)  # branch name -> head commit SHA as of the last successful sync
+    last_synced = models.DateTimeField(null=True)
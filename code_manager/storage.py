@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+def get_code_storage():
+    """
+    Storage of the code archives (`UserCode.source_code` calls this once, when models are loaded), built from
+    CODE_STORAGE_BACKEND and CODE_STORAGE_OPTIONS. Defaults to the file system under MEDIA_ROOT; any S3-compatible
+    object store (AWS, MinIO, ...) can be used through django-storages, e.g. with
+    `storages.backends.s3boto3.S3Boto3Storage` and `{"bucket_name": ..., "endpoint_url": ...}` as options.
+    """
+    return import_string(settings.CODE_STORAGE_BACKEND)(**settings.CODE_STORAGE_OPTIONS)
+
+
+def presigned_url(storage, name: str, expire: int, filename: str = None, content_encoding: str = None):
+    """
+    Short-lived URL downloading `name` straight from the object store, so the bytes don't go through Django.
+
+    :param storage: storage holding the archive
+    :param name: storage name of the archive
+    :param expire: seconds the URL stays valid for
+    :param filename: file name the download is saved under
+    :param content_encoding: Content-Encoding the object is served with
+    :return: the URL, or None if `storage` can't sign URLs (e.g. local file system)
+    """
+    # S3-compatible storages from django-storages sign their URLs when querystring_auth is set
+    if not getattr(storage, 'querystring_auth', False):
+        return None
+    parameters = {'ResponseContentType': "application/octet-stream"}
+    if filename is not None:
+        parameters['ResponseContentDisposition'] = f"attachment; filename={filename}"
+    if content_encoding is not None:
+        parameters['ResponseContentEncoding'] = content_encoding
+    return storage.url(name, parameters=parameters, expire=expire)
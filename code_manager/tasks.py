@@ -2,43 +2,48 @@
 from datetime import timedelta, datetime
 
 from celery import shared_task
-# import concurrent.futures
+import concurrent.futures
 
+from django.conf import settings
 from django.core.files import File
 from django.core.cache import cache
+from django.db import connections
 from django.utils import timezone
-
+from django.utils.dateparse import parse_datetime
+
+from code_manager.artefacts import ArtefactCache
+from code_manager.blobs import store_blob, collect_garbage
+from code_manager.compression import CompressingReader, get_codec, get_extension
+from code_manager.github import GitHubClient, get_client
+from code_manager.identity import GitHubContentsSource
+from code_manager.mirrors import update_mirror, mirror_in_use, prune_mirrors, get_remote_heads
+from code_manager.models import Repository
+from code_manager.validation import validate_code_archive
 from game_engine.models import User, UserCode, UserPerformance
 
-from git import Repo
+from git import GitCommandError, Repo
 import os
-import requests
+import io
+import shutil
+import tarfile
 import tempfile
 import re
-import tarfile
+from pathlib import Path
 
 
-def list_classroom_repos(access_token, organization, prefix, params=None):
+TEMPLATE_REPO_URL = "https://github.com/ucl-cs-diamant/bot-template.git"
+CODE_REPOSITORY_PREFIX = "test-sample-code-"
+
+
+def list_classroom_repos(access_token, organization, prefix, params=None, client: GitHubClient = None):
     if access_token is None:
         raise ValueError("Invalid access token.")
     if params is None:
         params = {'per_page': 100}
+    client = get_client() if client is None else client
 
-    org_repos = list()
-    url = f"https://api.github.com/orgs/{organization}/repos"
-    headers = {'Accept': "application/vnd.github.v3+json",
-               'Authorization': f"token {access_token}", }
-
-    # Users of the language are advised to use the while-True form with an inner
-    # if-break when a do-while loop would have been appropriate.  PEP315
-    while True:
-        res = requests.get(url, headers=headers, params=params)
-        res.raise_for_status()
-        org_repos.extend(res.json())
-
-        if (next_url := res.links.get("next", None)) is None:
-            break
-        url = next_url['url']
+    # pages that haven't changed since the last listing are answered with an empty 304 and served from the client
+    org_repos = client.get_pages(f"{client.api_url}/orgs/{organization}/repos", token=access_token, params=params)
 
     classroom_repos = []
     for org_repo in org_repos:
@@ -48,30 +53,43 @@ def list_classroom_repos(access_token, organization, prefix, params=None):
     return classroom_repos
 
 
+def parse_identity(lines):
+    email = None
+    student_num = None
+    for line in lines:  # todo: this seems hacky. To improve?
+        if "Email address:" in line:
+            email = line[14:].strip()
+            if " " in email or not re.fullmatch(r"[^@]+@[^@]+\.[^@]+", email):
+                # print(f"rejecting email {email}")
+                return None
+        elif "Student number:" in line:
+            student_num = line[15:]
+            try:
+                student_num = int(student_num)
+            except (ValueError, TypeError):
+                # print(f"rejecting student number {student_num}")
+                return None
+
+        if email is not None and student_num is not None:
+            return student_num, email  # no need to read the rest of the file
+    return None
+
+
 def check_identity(file_path):
     with open(file_path, 'r') as identity_file:
-        identity_data = identity_file.readlines()
-        email = None
-        student_num = None
-        for line in identity_data:  # todo: this seems hacky. To improve?
-            if "Email address:" in line:
-                email = line[14:].strip()
-                if " " in email or not re.fullmatch(r"[^@]+@[^@]+\.[^@]+", email):
-                    # print(f"rejecting email {email}")
-                    return None
-                continue
-            if "Student number:" in line:
-                student_num = line[15:]
-                try:
-                    student_num = int(student_num)
-                except (ValueError, TypeError):
-                    # print(f"rejecting student number {student_num}")
-                    return None
-                continue
+        return parse_identity(identity_file)
 
-        if email is not None and student_num is not None:
-            return student_num, email
-        return None
+
+def find_identity(repo, source):
+    """
+    :param repo: repository dict from the GitHub API
+    :param source: identity file source, see GitHubContentsSource
+    :return: (student number, email address) from the first identity file found, None if there is none
+    """
+    for name in source.candidate_files(repo):
+        if (identity := parse_identity(source.read_file(repo, name).splitlines())) is not None:
+            return identity
+    return None
 
 
 def create_user(student_id, email_address, github_username):
@@ -89,173 +107,431 @@ def create_user(student_id, email_address, github_username):
                                github_username=github_username)
 
 
-def clone_repo(repo_url: str, destination: str) -> Repo:
-    # cloning of private repository possible by providing <username>:<personal access token> pair
-    # use https://<username>:<personal access token>@github.com/repo_owner/repo_name
-    auth_url_string = f"{os.environ['GITHUB_API_TOKEN_USER']}:{os.environ.get('GITHUB_API_TOKEN')}@github.com/".join(
-        # repo["clone_url"].split("github.com/")
-        repo_url.split("github.com/")
-    )
-    print(f"cloning repo {repo_url} for real")
-    repo = Repo.clone_from(auth_url_string, destination)
+def clone_repo(repo_url: str, destination: str, timeout: float = None) -> Repo:
+    """
+    Checks out `repo_url` into `destination` from its persistent mirror, only fetching what changed since the last
+    sync from GitHub.
+
+    :param repo_url: https clone URL of the repository
+    :param destination: directory to clone into
+    :param timeout: seconds after which fetching from GitHub is killed, defaults to INGESTION_CLONE_TIMEOUT
+    """
+    with mirror_in_use(repo_url):
+        mirror = update_mirror(repo_url, timeout=timeout)
+        repo = Repo.clone_from(mirror.git_dir, destination)  # local clone, hardlinks objects where possible
+    repo.remotes.origin.set_url(repo_url)
     return repo
 
 
+def run_in_pool(worker, items, max_workers: int = None, label=str):
+    """
+    Runs `worker(item)` for every item on a bounded thread pool, or inline if `max_workers` is 1. An exception raised
+    for one item is reported and returned, it does not stop the other items.
+
+    :param worker: callable taking a single item
+    :param items: iterable of items to process
+    :param max_workers: pool size, defaults to INGESTION_WORKERS
+    :param label: callable describing an item in failure messages
+    :return: list of (item, result) pairs in completion order, result being the exception raised if worker failed
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get("INGESTION_WORKERS", 4))
+
+    def collect(item, run):
+        try:
+            results.append((item, run()))
+        except Exception as e:
+            print(f"failed processing {label(item)}: {e!r}")
+            results.append((item, e))
+
+    def run_isolated(item):
+        try:
+            return worker(item)
+        finally:
+            connections.close_all()  # connections are per-thread, don't leak one per pool thread
+
+    results = []
+    if max_workers <= 1:
+        for item in items:
+            collect(item, lambda: worker(item))
+        return results
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_isolated, item): item for item in items}
+        for future in concurrent.futures.as_completed(futures):
+            collect(futures[future], future.result)
+    return results
+
+
+def authorize_user_from_repo(repo, prefix, source=None):
+    username = repo["name"][len(prefix):]
+    if User.objects.filter(github_username=username).exists():
+        return
+    # if user not exist, look up the ID in the repo's top level files, and create User
+    # todo: ####  ADD A TOKEN CHECK, USERS WILL BE PRE-GENERATED INSTEAD OF BEING CREATED HERE ####
+    if (identity := find_identity(repo, GitHubContentsSource() if source is None else source)) is None:
+        return
+
+    student_id, student_email = identity
+    create_user(student_id, student_email, username)
+    # print(f"Created user: {student_id} - {username}")
+
+
 @shared_task
-def fetch_user_authorization():
+def fetch_user_authorization(source=None):
+    """
+    :param source: identity file source shared by all repositories, defaults to a GitHubContentsSource
+    """
     prefix = "test-assignment-"
     repos = list_classroom_repos(os.environ.get("GITHUB_API_TOKEN"), "ucl-cs-diamant", prefix=prefix)
-    for repo in repos:
-        username = repo["name"][len(prefix):]
-        if User.objects.filter(github_username=username).exists():
-            continue
-        # if user not exist, clone repo, scan for ID, and create User
-        with tempfile.TemporaryDirectory() as temp_dir:
-            clone_repo(repo["clone_url"], temp_dir)
-
-            # todo: ####  ADD A TOKEN CHECK, USERS WILL BE PRE-GENERATED INSTEAD OF BEING CREATED HERE ####
-            for path in os.listdir(temp_dir):
-                path = os.path.join(temp_dir, path)
-                if not os.path.isfile(path) and os.stat(path).st_size >= 1024:  # skip over large files
-                    continue
-                if (identity := check_identity(path)) is None:
-                    continue
-
-                student_id, student_email = identity
-                create_user(student_id, student_email, username)
-                # print(f"Created user: {student_id} - {username}")
-                break  # breaks inner loop, resumes outer loop
+    source = GitHubContentsSource() if source is None else source
+    run_in_pool(lambda repo: authorize_user_from_repo(repo, prefix, source), repos, label=lambda repo: repo["name"])
+
+
+def install_template(template_sha: str, directory) -> Path:
+    """
+    Moves `directory` to TEMPLATE_CACHE_ROOT/<template_sha>, unless that commit is already there, and removes copies
+    of older commits. `directory` is left (empty) in place for its TemporaryDirectory to clean up.
+
+    :param directory: temporary directory holding the template, under TEMPLATE_CACHE_ROOT
+    :return: path of the extracted copy
+    """
+    template_root = Path(settings.TEMPLATE_CACHE_ROOT)
+    template_path = template_root.joinpath(template_sha)
+    if not template_path.exists():
+        try:
+            os.rename(directory, template_path)
+            os.makedirs(directory)
+        except OSError:  # extracted concurrently by another worker
+            pass
+
+    for old_template in template_root.iterdir():
+        if old_template.name != template_sha and not old_template.name.startswith("tmp"):
+            shutil.rmtree(old_template, ignore_errors=True)
+    return template_path
+
+
+def pack_directory(directory) -> bytes:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz", format=tarfile.GNU_FORMAT) as tar_out:
+        for dir_entry in os.listdir(directory):
+            # arcname removes temp_dir prefix from tar
+            tar_out.add(os.path.join(directory, dir_entry), arcname=dir_entry)
+    return buffer.getvalue()
 
 
 def update_template(cache_key, update_time_key):
-    template_repo_url = "https://github.com/ucl-cs-diamant/bot-template.git"
-    temp_dir = tempfile.TemporaryDirectory()
-    clone_repo(template_repo_url, temp_dir.name)
-    repo_instance = Repo(temp_dir.name)
-
-    archive = archive_directory(temp_dir.name)
-    mem_buf_archive = archive.read()
-    cache.set(cache_key, mem_buf_archive, timeout=None)
+    """
+    Fetches the template repository and extracts its head commit to TEMPLATE_CACHE_ROOT/<commit SHA>, unless that
+    commit was already extracted. A packed copy is shared with other machines through the artefact cache.
+
+    :return: Repo instance of the extracted copy
+    """
+    template_root = Path(settings.TEMPLATE_CACHE_ROOT)
+    template_root.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=template_root) as temp_dir:
+        template_sha = clone_repo(TEMPLATE_REPO_URL, temp_dir).head.commit.hexsha
+        template_path = install_template(template_sha, temp_dir)
+
+    artefact_digest = ArtefactCache().put(pack_directory(template_path))
+    cache.set(cache_key, (template_sha, artefact_digest), timeout=None)
     cache.set(update_time_key, timezone.now(), timeout=None)
+    return Repo(template_path)
 
-    return temp_dir, repo_instance
 
+def extract_template(template_sha: str, artefact_digest: str):
+    """
+    Extracts the template from the artefact cache, for machines that didn't fetch it themselves.
 
-def extract_from_bytes_to_temp(source):
-    dest_path = tempfile.TemporaryDirectory()
-    with tempfile.TemporaryFile("w+b") as temp_outfile:
-        temp_outfile.write(source)
-        temp_outfile.flush()
-        temp_outfile.seek(0)
-        with tarfile.open(fileobj=temp_outfile, mode='r') as template_tar:
-            template_tar.extractall(dest_path.name)
-    return dest_path
+    :return: Repo instance of the extracted copy, None if the artefact is gone
+    """
+    template_root = Path(settings.TEMPLATE_CACHE_ROOT)
+    template_root.mkdir(parents=True, exist_ok=True)
+    with ArtefactCache().open(artefact_digest) as template_archive:
+        if template_archive is None:
+            return None
+        with tempfile.TemporaryDirectory(dir=template_root) as temp_dir:
+            with tarfile.open(fileobj=template_archive, mode='r') as template_tar:
+                template_tar.extractall(temp_dir)
+            return Repo(install_template(template_sha, temp_dir))
 
 
 def get_template(update=False,
-                 cache_key='template_repository',
+                 cache_key='template_artefact',
                  update_time_threshold: int = 3600,
                  update_time_key: str = 'template_repo_last_updated'):
     """
+    Resolves the template repository, only fetching it if the local copy is missing or out of date.
 
     :param update: Force updating template cache
     :param update_time_threshold: Time to keep template in cache before updating
     :param update_time_key: Key to use for template cache last updated time
-    :param cache_key: Key to use for template cache
-    :return: (TemporaryDirectory instance, Repo instance). tempdir instance is needed to keep it in scope
+    :param cache_key: Key to use for the (commit SHA, artefact digest) of the cached template
+    :return: Repo instance of the template, extracted under TEMPLATE_CACHE_ROOT
     """
     template_last_updated = cache.get(update_time_key, default=datetime.fromtimestamp(0).astimezone(timezone.utc))
-    template_repository = cache.get(cache_key)
+    cached_template = cache.get(cache_key)
 
-    if update or template_repository is None:
+    expired = (timezone.now() - template_last_updated) > timedelta(seconds=update_time_threshold)
+    # entries written by older releases (e.g. the raw template archive) are treated as missing
+    if not isinstance(cached_template, tuple) or len(cached_template) != 2:
+        cached_template = None
+    if update or expired or cached_template is None:
         print(f"updating template cache, last update: {template_last_updated}")
         return update_template(cache_key=cache_key, update_time_key=update_time_key)
 
-    temp_dir = extract_from_bytes_to_temp(template_repository)
-    repo_instance = Repo(temp_dir.name)
-    # could be more efficient, but this was written at 4 in the morning
-    if (timezone.now() - template_last_updated) > timedelta(seconds=update_time_threshold):
-        return update_template(cache_key=cache_key, update_time_key=update_time_key)
+    template_sha, artefact_digest = cached_template
+    if (template_path := Path(settings.TEMPLATE_CACHE_ROOT).joinpath(template_sha)).exists():
+        return Repo(template_path)
+    # the cache is shared between machines, this one may not have extracted the template yet
+    if (template_repo := extract_template(template_sha, artefact_digest)) is not None:
+        return template_repo
+    return update_template(cache_key=cache_key, update_time_key=update_time_key)
+
 
-    return temp_dir, repo_instance
+def assign_template(users, template_repo: Repo):
+    """
+    Gives every user in `users` a primary UserCode for the template's default branch. The template is archived once
+    and all the created UserCodes point at that archive, rows are inserted in bulk.
+
+    :param users: users without any UserCode
+    :param template_repo: template repository, see `get_template`
+    """
+    branch_name = template_repo.active_branch.name
+    template_code = UserCode(branch=branch_name)
+    save_code_archive(template_code, template_repo, branch_name)
+
+    UserCode.objects.bulk_create(
+        UserCode(user=user, branch=branch_name, to_clone=True, primary=True,
+                 source_code=template_code.source_code.name,
+                 commit_time=template_code.commit_time,
+                 commit_sha=template_code.commit_sha,
+                 content_hash=template_code.content_hash,
+                 archive_codec=template_code.archive_codec,
+                 has_failed=template_code.has_failed,
+                 validation_error=template_code.validation_error,
+                 archive_size=template_code.archive_size,
+                 updated_at=template_code.updated_at)
+        for user in users)
+    # re-read rather than rely on bulk_create setting primary keys, which not every database backend supports
+    codes = UserCode.objects.filter(user__in=users, branch=branch_name)
+    UserPerformance.objects.bulk_create(UserPerformance(code=code, user_id=code.user_id) for code in codes)
 
 
 def clone_from_template(user_instance: User, update=False, **kwargs):
-    td, template_repo = get_template(update, **kwargs)
-    create_or_update_user_code(branch=(template_repo.active_branch.name, template_repo.active_branch.name),
-                               clone_working_dir=td.name,
-                               repo=template_repo,
-                               user_instance=user_instance)
+    assign_template([user_instance], get_template(update, **kwargs))
 
 
-# def create_or_update_user_code(branch_name, clone_working_dir, repo, repo_default_branch, user_instance):
-def create_or_update_user_code(branch: tuple, clone_working_dir, repo, user_instance):
+def get_branch_heads(repo: Repo) -> dict:
+    """
+    :return: dict: branch name -> head Commit. Bare mirrors keep branches under refs/heads, working clones under
+    refs/remotes/origin
+    """
+    if repo.bare:
+        return {head.name: head.commit for head in repo.heads}
+    return {ref.remote_head: ref.commit for ref in repo.remotes.origin.refs if ref.remote_head != "HEAD"}
+
+
+def record_branch_head(code_instance, repo, branch_name):
+    """
+    Metadata-only update for branches that aren't enabled: keeps the code listed in the user's settings without
+    archiving it. `commit_sha` is only set once the branch is archived, see `archive_enabled_code`. Codes archived
+    before they were disabled keep describing that archive.
+    """
+    if code_instance.source_code:
+        return
+    code_instance.commit_time = get_branch_heads(repo)[branch_name].committed_datetime
+
+
+def create_or_update_user_code(branch: tuple, repo, user_instance):
     branch_name, repo_default_branch = branch
 
     code_instance = UserCode.objects.filter(user=user_instance, branch=branch_name).first()
     if code_instance is None:
         code_instance = UserCode(user=user_instance, branch=branch_name)
         code_instance.to_clone, code_instance.primary = (repo_default_branch == branch_name,) * 2
-    save_code_archive(clone_working_dir, code_instance, repo, branch_name)
+
+    # only the primary and enabled branches are played, others are archived once they get enabled
+    if code_instance.to_clone or code_instance.primary:
+        save_code_archive(code_instance, repo, branch_name)
+    else:
+        record_branch_head(code_instance, repo, branch_name)
     code_instance.save()
-    UserPerformance.objects.get_or_create(code=code_instance, user=code_instance.user)
+    if code_instance.source_code:
+        UserPerformance.objects.get_or_create(code=code_instance, user=code_instance.user)
 
 
-def create_or_update_branches(user_instance: User, repo: Repo, clone_working_dir):
-    repo_default_branch = repo.active_branch.name
-    repo_branches = {line.strip().split('origin/')[-1] for line in repo.git.branch('-r').splitlines()}
+def create_or_update_branches(user_instance: User, repo: Repo, max_workers: int = None):
+    """
+    Archives every branch of `repo` straight from the object database. Branches don't share a working tree, so they
+    can be processed concurrently, INGESTION_BRANCH_WORKERS at a time (default 1).
 
-    for branch_name in repo_branches:
-        # code_instance, created = UserCode.objects.get_or_create(user=user_instance, branch=repo_branch_name)
-        create_or_update_user_code(branch=(branch_name, repo_default_branch), clone_working_dir=clone_working_dir,
-                                   repo=repo, user_instance=user_instance)
+    :raises RuntimeError: if any branch failed, after all the other branches were processed
+    """
+    if max_workers is None:
+        max_workers = int(os.environ.get("INGESTION_BRANCH_WORKERS", 1))
+    repo_default_branch = repo.active_branch.name
 
+    def archive_branch(branch_name):
+        # a Repo reads objects through one long-running `git cat-file` process, which can't be shared across threads
+        worker_repo = Repo(repo.git_dir) if max_workers > 1 else repo
+        try:
+            create_or_update_user_code(branch=(branch_name, repo_default_branch), repo=worker_repo,
+                                       user_instance=user_instance)
+        finally:
+            if worker_repo is not repo:
+                worker_repo.close()
 
-def archive_directory(directory):
-    temp_file = tempfile.TemporaryFile()
-    with tarfile.open(fileobj=temp_file, mode="w", format=tarfile.GNU_FORMAT) as tar_out:
-        for dir_entry in os.listdir(directory):
-            # arcname removes temp_dir prefix from tar
-            tar_out.add(os.path.join(directory, dir_entry), arcname=dir_entry)
-    temp_file.seek(0)
-    return temp_file
+    results = run_in_pool(archive_branch, get_branch_heads(repo), max_workers=max_workers)
+    if failed_branches := [branch_name for branch_name, result in results if isinstance(result, Exception)]:
+        raise RuntimeError(f"failed to archive branch(es) {', '.join(failed_branches)} of {repo.git_dir}")
 
 
-def save_code_archive(clone_working_dir, code_instance, repo, branch_name):
-    if code_instance.commit_sha == repo.refs[f"origin/{branch_name}"].commit.hexsha:
+def save_code_archive(code_instance, repo, branch_name):
+    branch_head = get_branch_heads(repo)[branch_name]
+    if code_instance.commit_sha == branch_head.hexsha:
         print(f"{branch_name} not changed")
         return
 
-    repo.git.checkout(branch_name)
-    branch_head_sha = repo.branches[branch_name].commit.hexsha
-    repo_name = repo.remotes.origin.url.split('.git')[0].split('/')[-1]
-    branch_head_commit_time = repo.active_branch.commit.committed_datetime
+    code_instance.commit_sha = branch_head.hexsha
+    code_instance.commit_time = branch_head.committed_datetime
+    # a new commit gets a fresh start, whatever the previous one did in matches
+    code_instance.consecutive_failures = 0
+    code_instance.quarantined_until = None
+
+    codec = get_codec()
+
+    def write_archive(storage, name):
+        # `git archive` exports the commit's tree without a checkout and without .git, compressed on its way into
+        # storage
+        archive_process = repo.git.archive(branch_head.hexsha, format="tar", as_process=True)
+        saved_name = storage.save(name, File(CompressingReader(archive_process.stdout, codec)))
+        try:
+            archive_process.wait()
+        except GitCommandError:
+            storage.delete(saved_name)
+            raise
+        return saved_name
+
+    # archives are stored once per distinct tree, identical code across users and branches shares one blob
+    code_instance.content_hash = branch_head.tree.hexsha
+    code_instance.archive_codec = codec
+    code_instance.source_code.name = store_blob(code_instance.source_code.storage, code_instance.content_hash,
+                                                write_archive, extension=get_extension(codec))
+
+    # codes that can't possibly run are kept out of matchmaking rather than failing on a runner
+    errors = validate_code_archive(code_instance.source_code.storage, code_instance.source_code.name, codec)
+    code_instance.has_failed = bool(errors)
+    code_instance.validation_error = "\n".join(errors)
+    code_instance.archive_size = code_instance.source_code.storage.size(code_instance.source_code.name)
+    code_instance.updated_at = timezone.now()
+    if errors:
+        print(f"{branch_name} failed validation: {'; '.join(errors)}")
+
+
+def repository_unchanged(repository: Repository, pushed_at: datetime = None):
+    """
+    Cheap pre-flight check against the last sync: first the `pushed_at` time from the org listing, which costs
+    nothing, then the remote branch heads, which cost one `git ls-remote` round trip.
 
-    code_instance.commit_sha = branch_head_sha
-    code_instance.commit_time = branch_head_commit_time
-    code_instance.has_failed = False
+    :return: 2-tuple: (unchanged, remote branch heads or None if they were not needed)
+    """
+    if repository.last_synced is not None and pushed_at is not None and repository.pushed_at == pushed_at:
+        return True, None
+
+    remote_heads = get_remote_heads(repository.clone_url)
+    return repository.last_synced is not None and remote_heads == repository.branch_heads, remote_heads
+
+
+def ingest_repository(repo, prefix):
+    username = repo["name"][len(prefix):]
+    if (user_instance := User.objects.filter(github_username=username).first()) is None:
+        return
 
-    temp_file = archive_directory(clone_working_dir)
-    code_instance_filename = f"{repo_name}-{branch_name}-{repo.head.reference.commit.hexsha}.tar"
-    code_instance.source_code.save(code_instance_filename, File(temp_file))
+    repository, _ = Repository.objects.get_or_create(clone_url=repo["clone_url"],
+                                                     defaults={'name': repo["name"], 'owner': user_instance})
+    pushed_at = parse_datetime(repo["pushed_at"]) if repo.get("pushed_at") else None
+    unchanged, remote_heads = repository_unchanged(repository, pushed_at)
+    if not unchanged:
+        # branches are archived straight from the mirror, no working copy needed
+        with mirror_in_use(repo["clone_url"]):
+            create_or_update_branches(user_instance, update_mirror(repo["clone_url"]))
+    else:
+        print(f"{repo['name']} not changed since last sync")
+
+    repository.pushed_at = pushed_at
+    repository.branch_heads = remote_heads if remote_heads is not None else repository.branch_heads
+    repository.last_synced = timezone.now()
+    repository.save()
 
 
 @shared_task
 def clone_repositories():
     # todo: move prefix to config/env file
-    prefix = "test-sample-code-"
+    prefix = CODE_REPOSITORY_PREFIX
     repos = list_classroom_repos(os.environ.get("GITHUB_API_TOKEN"), "ucl-cs-diamant", prefix=prefix)
-    for repo in repos:
-        username = repo["name"][len(prefix):]
-        if (user_instance := User.objects.filter(github_username=username).first()) is not None:
-            # if user exists, clone repo and tar directory
-            with tempfile.TemporaryDirectory() as temp_dir:
-                repo_instance = clone_repo(repo["clone_url"], temp_dir)
-                create_or_update_branches(user_instance, repo_instance, temp_dir)
+    run_in_pool(lambda repo: ingest_repository(repo, prefix), repos, label=lambda repo: repo["name"])
+
+
+@shared_task
+def ingest_branch(repo_name, clone_url, branch_name, head_sha=None):
+    """
+    Ingests a single pushed branch, see `code_manager.views.github_push`.
+
+    :param repo_name: repository name, the owner's GitHub username prefixed with CODE_REPOSITORY_PREFIX
+    :param clone_url: https clone URL of the repository
+    :param branch_name: pushed branch
+    :param head_sha: head commit of the push, recorded as the branch head for the next full sync's pre-flight check
+    """
+    username = repo_name[len(CODE_REPOSITORY_PREFIX):]
+    if (user_instance := User.objects.filter(github_username=username).first()) is None:
+        print(f"no user for pushed repository {repo_name}")
+        return
+
+    repository, _ = Repository.objects.get_or_create(clone_url=clone_url,
+                                                     defaults={'name': repo_name, 'owner': user_instance})
+    with mirror_in_use(clone_url):
+        mirror = update_mirror(clone_url)
+        create_or_update_user_code(branch=(branch_name, mirror.active_branch.name), repo=mirror,
+                                   user_instance=user_instance)
+        repository.branch_heads[branch_name] = head_sha or mirror.heads[branch_name].commit.hexsha
+    repository.last_synced = timezone.now()
+    repository.save(update_fields=['branch_heads', 'last_synced'])
 
 
 @shared_task
 def create_usercode_instance():
-    bare_users = User.objects.filter(usercode=None)
-    for user in bare_users:
-        clone_from_template(user)
+    bare_users = list(User.objects.filter(usercode=None))
+    if bare_users:
+        assign_template(bare_users, get_template())
+
+
+@shared_task
+def prune_repository_mirrors():
+    for mirror in prune_mirrors():
+        print(f"removed repository mirror {mirror}")
+
+
+@shared_task
+def collect_code_archive_garbage():
+    for name in collect_garbage(UserCode._meta.get_field('source_code').storage):
+        print(f"removed unreferenced code archive {name}")
+
+
+@shared_task
+def archive_enabled_code(code_id):
+    """
+    Archives a branch that was recorded as metadata only, once its owner enables it.
+    """
+    code_instance = UserCode.objects.select_related('user').get(pk=code_id)
+    repository = Repository.objects.filter(owner=code_instance.user, clone_url__isnull=False) \
+        .order_by('-last_synced').first()
+    if repository is None:
+        print(f"no repository known for UserCode {code_id}")
+        return
+
+    with mirror_in_use(repository.clone_url):
+        mirror = update_mirror(repository.clone_url)
+        create_or_update_user_code(branch=(code_instance.branch, mirror.active_branch.name),
+                                   repo=mirror,
+                                   user_instance=code_instance.user)
@@ -0,0 +1,62 @@
+import mmap
+import os
+import tempfile
+
+from django.core.cache import caches
+from django.test import TestCase
+
+from code_manager.artefacts import ArtefactCache
+
+
+class ArtefactCacheTest(TestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.TemporaryDirectory()
+        self.artefacts = ArtefactCache(root=self.root.name, max_bytes=1000, shared_cache='default',
+                                       key_prefix='test-artefact:')
+
+    def tearDown(self) -> None:
+        self.root.cleanup()
+
+    def test_local_read_is_mapped(self):
+        digest = self.artefacts.put(b"template" * 10)
+
+        with self.artefacts.open(digest) as data:
+            self.assertIsInstance(data, mmap.mmap)
+            self.assertEqual(b"template" * 10, data.read())
+
+    def test_local_miss_served_from_shared_cache(self):
+        digest = self.artefacts.put(b"template")
+        os.remove(self.artefacts.get_path(digest))
+
+        with self.artefacts.open(digest) as data:
+            self.assertEqual(b"template", data.read())
+        self.assertTrue(self.artefacts.get_path(digest).exists())
+
+    def test_corrupt_copy_dropped(self):
+        digest = self.artefacts.put(b"template")
+        with open(self.artefacts.get_path(digest), 'wb') as artefact_file:
+            artefact_file.write(b"tampered")
+
+        with self.artefacts.open(digest) as data:
+            self.assertEqual(b"template", data.read())
+
+        caches['default'].set(f"test-artefact:{digest}", b"tampered")
+        os.remove(self.artefacts.get_path(digest))
+        with self.artefacts.open(digest) as data:
+            self.assertIsNone(data)
+
+    def test_missing(self):
+        with self.artefacts.open('0' * 64) as data:
+            self.assertIsNone(data)
+
+    def test_least_recently_used_evicted(self):
+        first = self.artefacts.put(b"1" * 400)
+        second = self.artefacts.put(b"2" * 400)
+        os.utime(self.artefacts.get_path(second), (0, 0))
+        third = self.artefacts.put(b"3" * 400)
+
+        self.assertTrue(self.artefacts.get_path(first).exists())
+        self.assertFalse(self.artefacts.get_path(second).exists())
+        self.assertTrue(self.artefacts.get_path(third).exists())
+        with self.artefacts.open(second) as data:  # still in the shared tier
+            self.assertEqual(b"2" * 400, data.read())
@@ -0,0 +1,111 @@
+import os
+import tempfile
+from datetime import timedelta
+from unittest.mock import Mock, patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from git import Repo
+
+import code_manager.tasks
+from code_manager import blobs
+from game_engine.models import User, UserCode
+
+
+class BlobStoreTest(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.media_root.name)
+
+    def tearDown(self) -> None:
+        self.media_root.cleanup()
+
+    def write(self, content):
+        def write_content(storage, name):
+            self.writes += 1
+            return storage.save(name, ContentFile(content))
+        self.writes = 0
+        return write_content
+
+    def test_store_once(self):
+        write = self.write(b"bot")
+        first = blobs.store_blob(self.storage, 'ab' * 20, write)
+        second = blobs.store_blob(self.storage, 'ab' * 20, write)
+
+        self.assertEqual(first, second)
+        self.assertEqual(1, self.writes)
+        self.assertEqual(blobs.get_blob_name('ab' * 20), first)
+
+    def test_collect_garbage(self):
+        user = User.objects.create(student_id=1)
+        referenced = blobs.store_blob(self.storage, 'aa' * 20, self.write(b"kept"))
+        unreferenced = blobs.store_blob(self.storage, 'bb' * 20, self.write(b"dropped"))
+        recent = blobs.store_blob(self.storage, 'cc' * 20, self.write(b"being ingested"))
+        UserCode.objects.create(user=user, source_code=referenced, commit_time=timezone.now())
+
+        old = (timezone.now() - timedelta(days=1)).timestamp()
+        for name in (referenced, unreferenced):
+            os.utime(self.storage.path(name), (old, old))
+
+        self.assertEqual([unreferenced], blobs.collect_garbage(self.storage))
+        self.assertTrue(self.storage.exists(referenced))
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(self.storage.exists(unreferenced))
+
+    def test_reused_blob_not_collected(self):
+        name = blobs.store_blob(self.storage, 'aa' * 20, self.write(b"old tree"))
+        old = (timezone.now() - timedelta(days=1)).timestamp()
+        os.utime(self.storage.path(name), (old, old))
+
+        # a revert to an old tree reuses the blob, its UserCode is only saved after validation
+        self.assertEqual(name, blobs.store_blob(self.storage, 'aa' * 20, self.write(b"old tree")))
+        self.assertEqual([], blobs.collect_garbage(self.storage))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_blob_referenced_during_collection_kept(self):
+        user = User.objects.create(student_id=1)
+        name = blobs.store_blob(self.storage, 'aa' * 20, self.write(b"old tree"))
+        old = (timezone.now() - timedelta(days=1)).timestamp()
+        os.utime(self.storage.path(name), (old, old))
+
+        list_blobs = blobs.list_blobs
+
+        def save_code_while_listing(storage):
+            UserCode.objects.create(user=user, source_code=name, commit_time=timezone.now())
+            return list_blobs(storage)
+
+        with patch('code_manager.blobs.list_blobs', side_effect=save_code_while_listing):
+            self.assertEqual([], blobs.collect_garbage(self.storage))
+        self.assertTrue(self.storage.exists(name))
+
+    def test_reused_blob_rewritten_without_local_path(self):
+        name = blobs.store_blob(self.storage, 'aa' * 20, self.write(b"old tree"))
+        write = Mock(return_value=name)
+        with patch.object(self.storage, 'path', side_effect=NotImplementedError):
+            self.assertEqual(name, blobs.touch_blob(self.storage, name, write))
+        write.assert_called_once_with(self.storage, name)
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class DeduplicatedArchiveTest(TestCase):
+    def test_identical_code_shares_blob(self):
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as source_dir, \
+                override_settings(MEDIA_ROOT=media_root):
+            source = Repo.init(source_dir)
+            with open(os.path.join(source_dir, 'main.py'), 'w') as outfile:
+                outfile.write("print('hello')\n")
+            source.index.add(['main.py'])
+            source.index.commit("Initial commit")
+            source.create_remote('origin', source_dir).fetch()
+
+            codes = []
+            for i in range(3):
+                user = User.objects.create(student_id=i, github_username=str(i))
+                codes.append(UserCode(user=user, branch=source.active_branch.name, primary=True))
+                code_manager.tasks.save_code_archive(codes[-1], source, source.active_branch.name)
+
+            self.assertEqual(1, len({code.source_code.name for code in codes}))
+            self.assertEqual(source.head.commit.tree.hexsha, codes[0].content_hash)
+            self.assertEqual([codes[0].source_code.name], blobs.list_blobs(codes[0].source_code.storage))
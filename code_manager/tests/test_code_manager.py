@@ -1,16 +1,23 @@
 import os
+import shutil
 from unittest.mock import patch, mock_open
 from pathlib import Path
 
 import tarfile
+import tempfile
+import threading
+import time
 
 from django.utils import timezone
 
+import code_manager.mirrors
 import code_manager.tasks
-from game_engine.models import User, UserCode
+from code_manager.models import Repository
+from game_engine.models import User, UserCode, UserPerformance
 from code_manager.tasks import check_identity
 
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from git import Repo
 from django.core.cache import cache
 
 __location__ = os.path.realpath(os.path.join(os.getcwd(), os.path.dirname(__file__)))
@@ -64,6 +71,18 @@ class TemplateCloningTest(TestCase):
     def setUp(self) -> None:
         self.test_cache_key = 'test-cache-key'
         self.test_update_key = 'test-update-key'
+        self.media_root = tempfile.TemporaryDirectory()
+        self.template_root = tempfile.TemporaryDirectory()
+        self.artefact_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name,
+                                                   TEMPLATE_CACHE_ROOT=self.template_root.name,
+                                                   ARTEFACT_CACHE_ROOT=self.artefact_root.name)
+        self.settings_override.enable()
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        for temp_dir in (self.media_root, self.template_root, self.artefact_root):
+            temp_dir.cleanup()
 
     @staticmethod
     def get_files_in_directory(path):
@@ -83,16 +102,14 @@ class TemplateCloningTest(TestCase):
                 tf.extractall(output_dir)
         with open(output_dir_path.joinpath(Path('test_file_sentry')), 'wb') as outfile:
             outfile.write(b"Yep.")
+        return Repo(output_dir)
 
     @staticmethod
     def mock_clone_repo(_, output_dir):
         with open(os.path.join(__location__, "sample_template.tar"), "rb") as in_tar:
             with tarfile.open(fileobj=in_tar) as tf:
                 tf.extractall(output_dir)
-
-    def set_template_cache(self):
-        with open(os.path.join(__location__, "sample_template.tar"), "rb") as in_tar:
-            cache.set(self.test_cache_key, in_tar.read())
+        return Repo(output_dir)
 
     @staticmethod
     def get_template_files():
@@ -101,84 +118,94 @@ class TemplateCloningTest(TestCase):
                 actual_files = {a.name for a in tf.getmembers() if a.isfile()}
         return actual_files
 
-    def test_tarfile_extract(self):
-        with open(os.path.join(__location__, "sample_template.tar"), "rb") as in_tar:
-            with tarfile.open(fileobj=in_tar) as tf:
-                actual_files = {a.name for a in tf.getmembers() if a.isfile()}
-
-        with open(os.path.join(__location__, "sample_template.tar"), "rb") as in_tar:
-            temp_dir = code_manager.tasks.extract_from_bytes_to_temp(in_tar.read())
-
-        test_out_files = self.get_files_in_directory(temp_dir.name)
-        self.assertSetEqual(test_out_files, actual_files)
+    def get_template(self, **kwargs):
+        return code_manager.tasks.get_template(cache_key=self.test_cache_key, update_time_key=self.test_update_key,
+                                               **kwargs)
 
     def test_update_template(self):
         sentry_filename = 'test_file_sentry'
         with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo_with_sentry):
-            temp_dir, repo_instance = code_manager.tasks.update_template(self.test_cache_key, self.test_update_key)
-            self.assertTrue(Path(temp_dir.name).joinpath(sentry_filename).exists())
-
-        template_repository = cache.get('test-cache-key')
-        temp_dir = code_manager.tasks.extract_from_bytes_to_temp(template_repository)
-
-        test_out_files = set()
-        for _, _, filenames in os.walk(temp_dir.name):
-            for filename in filenames:
-                test_out_files.add(filename)
+            repo_instance = code_manager.tasks.update_template(self.test_cache_key, self.test_update_key)
 
-        self.assertIn(sentry_filename, test_out_files)
+        template_path = Path(repo_instance.working_dir)
+        self.assertTrue(template_path.joinpath(sentry_filename).exists())
+        self.assertEqual(repo_instance.head.commit.hexsha, template_path.name)
+        self.assertEqual(repo_instance.head.commit.hexsha, cache.get(self.test_cache_key)[0])
+        self.assertEqual([template_path.name], os.listdir(self.template_root.name))  # no leftover temp directory
 
     def test_get_template_no_explicit_expired(self):
-        self.set_template_cache()
-        actual_files = self.get_template_files()
-
         with patch('code_manager.tasks.update_template',
                    wraps=code_manager.tasks.update_template) as update_template_mock, \
                 patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo):
-            td, repo = code_manager.tasks.get_template(cache_key=self.test_cache_key,
-                                                       update_time_key=self.test_update_key)
-            files_from_template = self.get_files_in_directory(td.name)
+            repo = self.get_template()
+            files_from_template = self.get_files_in_directory(repo.working_dir)
 
-            self.assertEqual(files_from_template, actual_files)
+            self.assertEqual(files_from_template, self.get_template_files())
             update_template_mock.assert_called_once()
 
     def test_get_template_no_explicit_not_expired(self):
-        self.set_template_cache()
-        actual_files = self.get_template_files()
-
-        cache.set(self.test_update_key, timezone.now())
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo):
+            first_repo = self.get_template()
 
         with patch('code_manager.tasks.update_template',
                    wraps=code_manager.tasks.update_template) as update_template_mock:
-            td, repo = code_manager.tasks.get_template(cache_key=self.test_cache_key,
-                                                       update_time_key=self.test_update_key)
-            files_from_template = self.get_files_in_directory(td.name)
+            repo = self.get_template()
 
-            self.assertEqual(files_from_template, actual_files)
+            self.assertEqual(first_repo.working_dir, repo.working_dir)
+            self.assertEqual(self.get_files_in_directory(repo.working_dir), self.get_template_files())
             update_template_mock.assert_not_called()
 
-    def test_get_template_explicit_update(self):
-        self.set_template_cache()
-        actual_files = self.get_template_files()
+    def test_get_template_missing_locally(self):
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo):
+            first_repo = self.get_template()
+        # another machine: neither the extracted copy nor the local artefact tier are there
+        shutil.rmtree(first_repo.working_dir)
+        shutil.rmtree(self.artefact_root.name)
+
+        with patch('code_manager.tasks.clone_repo') as clone_mock:
+            repo = self.get_template()
+
+        clone_mock.assert_not_called()
+        self.assertEqual(first_repo.working_dir, repo.working_dir)
+        self.assertEqual(self.get_files_in_directory(repo.working_dir), self.get_template_files())
+        self.assertEqual(first_repo.head.commit.hexsha, repo.head.commit.hexsha)
 
+    def test_get_template_missing_everywhere(self):
+        cache.set(self.test_cache_key, ('a' * 40, 'b' * 64))
         cache.set(self.test_update_key, timezone.now())
 
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo) as clone_mock:
+            repo = self.get_template()
+
+        clone_mock.assert_called_once()
+        self.assertEqual(repo.head.commit.hexsha, cache.get(self.test_cache_key)[0])
+
+    def test_get_template_legacy_cache_entry(self):
+        # older releases cached the packed template itself under the key
+        cache.set(self.test_cache_key, b"template archive bytes" * 10)
+        cache.set(self.test_update_key, timezone.now())
+
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo) as clone_mock:
+            repo = self.get_template()
+
+        clone_mock.assert_called_once()
+        self.assertEqual(repo.head.commit.hexsha, cache.get(self.test_cache_key)[0])
+
+    def test_get_template_explicit_update(self):
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo):
+            first_repo = self.get_template()
+
         with patch('code_manager.tasks.update_template',
                    wraps=code_manager.tasks.update_template) as update_template_mock, \
                 patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo):
-            td, repo = code_manager.tasks.get_template(cache_key=self.test_cache_key,
-                                                       update_time_key=self.test_update_key,
-                                                       update=True)
-            files_from_template = self.get_files_in_directory(td.name)
+            repo = self.get_template(update=True)
 
-            self.assertEqual(files_from_template, actual_files)
+            self.assertEqual(first_repo.working_dir, repo.working_dir)  # same commit, extracted copy reused
+            self.assertEqual(self.get_files_in_directory(repo.working_dir), self.get_template_files())
             update_template_mock.assert_called_once()
 
     # this kinda also tests `create_or_update_user_code`...
     def clone_from_template_test(self):
-        self.set_template_cache()
-        cache.set(self.test_update_key, timezone.now())
-
         user = User.objects.create(student_id=12345678)
 
         self.assertIsNone(UserCode.objects.filter(user=user).first())
@@ -192,3 +219,264 @@ class TemplateCloningTest(TestCase):
             code_manager.tasks.create_usercode_instance()
 
         self.assertEqual(UserCode.objects.all().count(), 1)
+
+    def test_create_usercode_instance_in_bulk(self):
+        users = [User.objects.create(student_id=i) for i in range(5)]
+        existing = UserCode.objects.create(user=users[0], branch="main", commit_time=timezone.now())
+
+        with patch('code_manager.tasks.clone_repo', wraps=self.mock_clone_repo) as clone_mock:
+            code_manager.tasks.create_usercode_instance()
+            code_manager.tasks.create_usercode_instance()  # nothing left to do
+
+        clone_mock.assert_called_once()
+        codes = UserCode.objects.exclude(pk=existing.pk)
+        self.assertEqual({user.pk for user in users[1:]}, {code.user_id for code in codes})
+        self.assertEqual(1, len({code.source_code.name for code in codes}))
+        self.assertTrue(all(code.primary and code.to_clone and code.commit_sha for code in codes))
+        self.assertEqual(4, UserPerformance.objects.filter(code__in=codes).count())
+        self.assertFalse(UserPerformance.objects.filter(code=existing).exists())
+
+
+class ParallelIngestionTest(TestCase):
+    @staticmethod
+    def create_local_repo(path):
+        repo = Repo.init(path)
+        with open(os.path.join(path, 'main.py'), 'w') as outfile:
+            outfile.write("print('hello')\n")
+        repo.index.add(['main.py'])
+        repo.index.commit("Initial commit")
+        return repo
+
+    def test_run_in_pool_isolates_failures(self):
+        def worker(item):
+            if item == 3:
+                raise ValueError("bad repo")
+            return item * 2
+
+        results = dict(code_manager.tasks.run_in_pool(worker, range(6), max_workers=3))
+        self.assertIsInstance(results.pop(3), ValueError)
+        self.assertEqual({0: 0, 1: 2, 2: 4, 4: 8, 5: 10}, results)
+
+    def test_run_in_pool_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def worker(_):
+            with lock:
+                running.append(None)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.pop()
+
+        code_manager.tasks.run_in_pool(worker, range(20), max_workers=3)
+        self.assertLessEqual(max(peak), 3)
+
+    @patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+    def test_clone_repo(self):
+        with tempfile.TemporaryDirectory() as source_dir, tempfile.TemporaryDirectory() as clone_dir, \
+                tempfile.TemporaryDirectory() as mirror_root, override_settings(REPOSITORY_MIRROR_ROOT=mirror_root):
+            source = self.create_local_repo(source_dir)
+            clone = code_manager.tasks.clone_repo(source_dir, clone_dir, timeout=30)
+            self.assertEqual(source.head.commit.hexsha, clone.head.commit.hexsha)
+            self.assertEqual(source_dir, clone.remotes.origin.url)
+
+    def test_clone_repositories_ingests_every_repo(self):
+        repos = [{'name': f"test-sample-code-user{i}", 'clone_url': f"https://github.com/org/user{i}.git"}
+                 for i in range(5)]
+        with patch('code_manager.tasks.list_classroom_repos', return_value=repos), \
+                patch('code_manager.tasks.ingest_repository') as ingest_mock:
+            ingest_mock.side_effect = lambda repo, _: 1 / int(repo['name'][-1])  # first repo fails
+            code_manager.tasks.clone_repositories()
+
+        self.assertEqual(sorted(repo['name'] for repo in repos),
+                         sorted(call.args[0]['name'] for call in ingest_mock.call_args_list))
+
+
+class PreflightTest(TestCase):
+    def setUp(self) -> None:
+        self.user = User.objects.create(student_id=1, github_username="student")
+        self.repo = {'name': "test-sample-code-student",
+                     'clone_url': "https://github.com/org/test-sample-code-student.git",
+                     'pushed_at': "2021-09-23T12:00:00Z"}
+        self.heads = {'master': 'a' * 40, 'feature': 'b' * 40}
+
+    def ingest(self, heads):
+        with patch('code_manager.tasks.get_remote_heads', return_value=heads) as heads_mock, \
+                patch('code_manager.tasks.update_mirror') as mirror_mock, \
+                patch('code_manager.tasks.mirror_in_use'), \
+                patch('code_manager.tasks.create_or_update_branches'):
+            code_manager.tasks.ingest_repository(self.repo, "test-sample-code-")
+        return heads_mock, mirror_mock
+
+    def test_first_sync_clones(self):
+        _, mirror_mock = self.ingest(self.heads)
+        mirror_mock.assert_called_once()
+
+        repository = Repository.objects.get(clone_url=self.repo['clone_url'])
+        self.assertEqual(self.user, repository.owner)
+        self.assertEqual(self.heads, repository.branch_heads)
+        self.assertIsNotNone(repository.last_synced)
+
+    def test_not_pushed_skips_ls_remote(self):
+        self.ingest(self.heads)
+        heads_mock, mirror_mock = self.ingest(self.heads)
+        heads_mock.assert_not_called()
+        mirror_mock.assert_not_called()
+
+    def test_same_heads_skips_clone(self):
+        self.ingest(self.heads)
+        self.repo['pushed_at'] = "2021-09-24T12:00:00Z"  # e.g. a pushed tag
+        heads_mock, mirror_mock = self.ingest(self.heads)
+        heads_mock.assert_called_once()
+        mirror_mock.assert_not_called()
+
+    def test_new_commit_clones(self):
+        self.ingest(self.heads)
+        self.repo['pushed_at'] = "2021-09-24T12:00:00Z"
+        _, mirror_mock = self.ingest(dict(self.heads, feature='c' * 40))
+        mirror_mock.assert_called_once()
+        self.assertEqual('c' * 40, Repository.objects.get().branch_heads['feature'])
+
+    def test_unknown_user_ignored(self):
+        self.repo['name'] = "test-sample-code-nobody"
+        _, mirror_mock = self.ingest(self.heads)
+        mirror_mock.assert_not_called()
+        self.assertFalse(Repository.objects.exists())
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class BranchArchiveTest(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.TemporaryDirectory()
+        self.mirror_root = tempfile.TemporaryDirectory()
+        self.source_dir = tempfile.TemporaryDirectory()
+        self.source = ParallelIngestionTest.create_local_repo(self.source_dir.name)
+        self.default_branch = self.source.active_branch.name
+        self.source.create_head('feature').checkout()
+        with open(os.path.join(self.source_dir.name, 'feature.py'), 'w') as outfile:
+            outfile.write("pass\n")
+        self.source.index.add(['feature.py'])
+        self.source.index.commit("feature")
+        self.source.heads[self.default_branch].checkout()
+
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name,
+                                                   REPOSITORY_MIRROR_ROOT=self.mirror_root.name)
+        self.settings_override.enable()
+        self.user = User.objects.create(student_id=1, github_username="student")
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        for temp_dir in (self.media_root, self.mirror_root, self.source_dir):
+            temp_dir.cleanup()
+
+    @staticmethod
+    def archive_members(user_code):
+        with user_code.source_code.open('rb') as archive, tarfile.open(fileobj=archive) as tf:
+            return {member.name for member in tf.getmembers()}
+
+    def test_branches_archived_from_mirror(self):
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        feature = UserCode.objects.create(user=self.user, branch='feature', to_clone=True, commit_time=timezone.now())
+        code_manager.tasks.create_or_update_branches(self.user, mirror)
+
+        primary = UserCode.objects.get(user=self.user, branch=self.default_branch)
+        feature.refresh_from_db()
+        self.assertTrue(primary.primary)
+        self.assertFalse(feature.primary)
+        self.assertEqual(self.source.heads['feature'].commit.hexsha, feature.commit_sha)
+
+        self.assertEqual({'main.py'}, self.archive_members(primary))
+        self.assertEqual({'main.py', 'feature.py'}, self.archive_members(feature))
+
+    @override_settings(CODE_ARCHIVE_CODEC='gzip')
+    def test_archives_compressed(self):
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        code_manager.tasks.create_or_update_branches(self.user, mirror)
+
+        primary = UserCode.objects.get(user=self.user, branch=self.default_branch)
+        self.assertEqual('gzip', primary.archive_codec)
+        self.assertTrue(primary.source_code.name.endswith('.tar.gz'))
+        with primary.source_code.open('rb') as archive:
+            self.assertEqual(b"\x1f\x8b", archive.read(2))  # gzip magic number
+        self.assertEqual({'main.py'}, self.archive_members(primary))
+
+    def test_disabled_branches_not_archived(self):
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        code_manager.tasks.create_or_update_branches(self.user, mirror)
+
+        feature = UserCode.objects.get(user=self.user, branch='feature')
+        self.assertFalse(feature.source_code)
+        self.assertEqual('', feature.commit_sha)
+        self.assertEqual(self.source.heads['feature'].commit.committed_datetime, feature.commit_time)
+        self.assertFalse(UserPerformance.objects.filter(code=feature).exists())
+        self.assertTrue(UserPerformance.objects.filter(code__branch=self.default_branch).exists())
+
+    def test_disabled_archived_branch_untouched(self):
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        commit_time = timezone.now() - timezone.timedelta(days=1)
+        feature = UserCode.objects.create(user=self.user, branch='feature', source_code="blobs/aa/old.tar.gz",
+                                          commit_sha='a' * 40, commit_time=commit_time)
+
+        code_manager.tasks.create_or_update_branches(self.user, mirror)
+
+        feature.refresh_from_db()
+        self.assertEqual('a' * 40, feature.commit_sha)
+        self.assertEqual("blobs/aa/old.tar.gz", feature.source_code.name)
+        self.assertEqual(commit_time, feature.commit_time)
+
+    def test_archive_enabled_code(self):
+        Repository.objects.create(name="repo", owner=self.user, clone_url=self.source_dir.name,
+                                  last_synced=timezone.now())
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        code_manager.tasks.create_or_update_branches(self.user, mirror)
+        feature = UserCode.objects.get(user=self.user, branch='feature')
+        feature.to_clone = True
+        feature.save()
+
+        code_manager.tasks.archive_enabled_code(feature.pk)
+
+        feature.refresh_from_db()
+        self.assertEqual({'main.py', 'feature.py'}, self.archive_members(feature))
+        self.assertEqual(self.source.heads['feature'].commit.hexsha, feature.commit_sha)
+        self.assertTrue(UserPerformance.objects.filter(code=feature).exists())
+
+    def test_failed_branch_reported(self):
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+        with patch('code_manager.tasks.save_code_archive', side_effect=OSError("disk full")):
+            self.assertRaises(RuntimeError, code_manager.tasks.create_or_update_branches, self.user, mirror)
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class ParallelBranchArchiveTest(TransactionTestCase):
+    """
+    Branches archived by concurrent workers, outside of a test transaction so the workers' connections see the rows.
+    """
+    setUp = BranchArchiveTest.setUp
+    tearDown = BranchArchiveTest.tearDown
+
+    def test_branches_in_parallel(self):
+        branches = {self.default_branch: {'main.py'}, 'feature': {'main.py', 'feature.py'}}
+        for i in range(4):
+            self.source.create_head(f"branch-{i}").checkout()
+            with open(os.path.join(self.source_dir.name, f"branch_{i}.py"), 'w') as outfile:
+                outfile.write(f"value = {i}\n")
+            self.source.index.add([f"branch_{i}.py"])
+            self.source.index.commit(f"branch {i}")
+            self.source.heads[self.default_branch].checkout()
+            branches[f"branch-{i}"] = {'main.py', f"branch_{i}.py"}
+        for branch_name in branches.keys() - {self.default_branch}:
+            UserCode.objects.create(user=self.user, branch=branch_name, to_clone=True, commit_time=timezone.now())
+        mirror = code_manager.mirrors.update_mirror(self.source_dir.name)
+
+        with patch('code_manager.tasks.save_code_archive', wraps=code_manager.tasks.save_code_archive) as save_mock:
+            code_manager.tasks.create_or_update_branches(self.user, mirror, max_workers=4)
+
+        worker_repos = [call.args[1] for call in save_mock.call_args_list]
+        self.assertEqual(len(branches), len({id(repo) for repo in worker_repos}))
+        self.assertFalse(any(repo is mirror for repo in worker_repos))
+        for branch_name, members in branches.items():
+            code = UserCode.objects.get(user=self.user, branch=branch_name)
+            self.assertEqual(self.source.heads[branch_name].commit.hexsha, code.commit_sha)
+            self.assertEqual(members, BranchArchiveTest.archive_members(code))
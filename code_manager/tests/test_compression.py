@@ -0,0 +1,34 @@
+import io
+
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+
+from code_manager import compression
+
+
+class CompressionTest(SimpleTestCase):
+    content = b"".join(str(i).encode() for i in range(100000))
+
+    def compress(self, codec):
+        reader = compression.CompressingReader(io.BytesIO(self.content), codec)
+        compressed = b""
+        while chunk := reader.read(1000):  # smaller reads than the compressor's output
+            compressed += chunk
+        return compressed
+
+    def test_round_trip(self):
+        for codec in ('none', 'gzip'):
+            with self.subTest(codec=codec):
+                compressed = self.compress(codec)
+                self.assertEqual(self.content, b"".join(compression.decompress_chunks(io.BytesIO(compressed), codec)))
+
+    def test_compresses(self):
+        self.assertEqual(self.content, self.compress('none'))
+        self.assertLess(len(self.compress('gzip')), len(self.content) / 2)
+
+    def test_codec_setting(self):
+        with override_settings(CODE_ARCHIVE_CODEC='gzip'):
+            self.assertEqual('gzip', compression.get_codec())
+            self.assertEqual('tar.gz', compression.get_extension(compression.get_codec()))
+        with override_settings(CODE_ARCHIVE_CODEC='rar'):
+            self.assertRaises(ImproperlyConfigured, compression.get_codec)
@@ -0,0 +1,108 @@
+import json
+import time
+from urllib.parse import parse_qs, urlparse
+
+import requests
+from django.test import SimpleTestCase
+
+from code_manager.github import GitHubClient
+from code_manager.tasks import list_classroom_repos
+
+
+class FakeGitHub:
+    """
+    Paginated org repository listing honouring If-None-Match, standing in for GitHub as a transport.
+    """
+
+    def __init__(self, repos, per_page=2, remaining=5000):
+        self.repos = repos
+        self.per_page = per_page
+        self.remaining = remaining
+        self.requests = []
+        self.rate_limited = 0
+
+    def response(self, status_code, body=None, headers=None):
+        response = requests.Response()
+        response.status_code = status_code
+        response._content = json.dumps(body).encode() if body is not None else b""
+        response.headers.update({'X-RateLimit-Remaining': str(self.remaining),
+                                 'X-RateLimit-Reset': str(time.time() + 3600), **(headers or {})})
+        return response
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.requests.append((method, url, headers))
+        if self.rate_limited:
+            self.rate_limited -= 1
+            return self.response(403, {'message': "secondary rate limit"}, {'Retry-After': '2'})
+
+        page = int(parse_qs(urlparse(url).query).get('page', [1])[0])
+        body = self.repos[(page - 1) * self.per_page:page * self.per_page]
+        etag = f'"{hash(json.dumps(body))}"'
+        if headers.get('If-None-Match') == etag:
+            return self.response(304)  # not counted against the rate limit
+
+        self.remaining -= 1
+        link_headers = {}
+        if page * self.per_page < len(self.repos):
+            link_headers['Link'] = f'<https://api.github.com/orgs/org/repos?per_page=100&page={page + 1}>; rel="next"'
+        return self.response(200, body, {'ETag': etag, **link_headers})
+
+
+class GitHubClientTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.github = FakeGitHub([{'name': f"test-sample-code-{i}"} for i in range(5)] + [{'name': "bot-template"}])
+        self.sleeps = []
+        self.client = GitHubClient(transport=self.github, sleep=self.sleeps.append, min_remaining=10, max_wait=60)
+
+    def list_repos(self):
+        return list_classroom_repos("token", "org", "test-sample-code-", client=self.client)
+
+    def test_listing_follows_pages(self):
+        repos = self.list_repos()
+
+        self.assertEqual([f"test-sample-code-{i}" for i in range(5)], [repo['name'] for repo in repos])
+        self.assertEqual(3, len(self.github.requests))
+        self.assertEqual("token token", self.github.requests[0][2]['Authorization'])
+
+    def test_unchanged_listing_is_conditional(self):
+        first = self.list_repos()
+        remaining = self.github.remaining
+
+        self.assertEqual(first, self.list_repos())
+        self.assertEqual(remaining - 1, self.github.remaining)  # all but the last page came back as a 304
+        self.assertEqual([True, True, False],
+                         ['If-None-Match' in headers for _, _, headers in self.github.requests[3:]])
+
+        self.github.repos.append({'name': "test-sample-code-new"})
+        self.assertEqual(6, len(self.list_repos()))
+
+    def test_retries_rate_limited_requests(self):
+        self.github.rate_limited = 2
+        self.assertEqual(5, len(self.list_repos()))
+        self.assertEqual([2.0, 2.0], self.sleeps)
+
+    def test_waits_for_budget(self):
+        self.github.remaining = 5
+        self.list_repos()
+        self.assertEqual(2, len(self.sleeps))  # after the budget fell under the reserve, before each later page
+        self.assertTrue(all(0 < wait <= 60 for wait in self.sleeps))
+
+    def test_budgets_per_token(self):
+        self.github.remaining = 5
+        self.client.get("https://api.github.com/user", token="user token")
+        self.client.get("https://api.github.com/user", token="user token")
+        self.assertEqual(1, len(self.sleeps))
+
+        # another token's low budget doesn't hold up the org token
+        self.github.remaining = 5000
+        self.list_repos()
+        self.assertEqual(1, len(self.sleeps))
+
+    def test_no_wait(self):
+        self.github.remaining = 5
+        self.client.get("https://api.github.com/user", token="user token")
+        self.github.rate_limited = 1
+        response = self.client.get("https://api.github.com/user", token="user token", wait=False)
+
+        self.assertEqual(403, response.status_code)
+        self.assertEqual([], self.sleeps)
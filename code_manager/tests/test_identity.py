@@ -0,0 +1,81 @@
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase, TestCase
+
+import code_manager.tasks
+from code_manager.github import GitHubClient
+from code_manager.identity import GitHubContentsSource
+from game_engine.models import User
+
+
+class StubSource:
+    def __init__(self, files):
+        self.files = files
+        self.read = []
+
+    def candidate_files(self, repo):
+        return list(self.files[repo['name']])
+
+    def read_file(self, repo, name):
+        self.read.append(name)
+        return self.files[repo['name']][name]
+
+
+class IdentityDiscoveryTest(TestCase):
+    def setUp(self) -> None:
+        self.source = StubSource({
+            'test-assignment-alice': {'README.md': "# bot\n",
+                                      'identity.txt': "Email address: alice@example.com\nStudent number: 1001\n",
+                                      'other.txt': "Email address: other@example.com\nStudent number: 1002\n"},
+            'test-assignment-bob': {'README.md': "# bot\n"},
+        })
+
+    def test_stops_at_first_match(self):
+        repo = {'name': 'test-assignment-alice'}
+        self.assertEqual((1001, 'alice@example.com'), code_manager.tasks.find_identity(repo, self.source))
+        self.assertEqual(['README.md', 'identity.txt'], self.source.read)
+
+    def test_fetch_user_authorization(self):
+        repos = [{'name': name} for name in self.source.files]
+        with patch('code_manager.tasks.list_classroom_repos', return_value=repos), \
+                patch('code_manager.tasks.clone_repo') as clone_mock:
+            code_manager.tasks.fetch_user_authorization(source=self.source)
+
+        clone_mock.assert_not_called()
+        self.assertEqual([(1001, 'alice@example.com', 'alice')],
+                         list(User.objects.values_list('student_id', 'email_address', 'github_username')))
+
+
+class GitHubContentsSourceTest(SimpleTestCase):
+    repo = {'full_name': 'ucl-cs-diamant/test-assignment-alice', 'default_branch': 'main'}
+
+    @staticmethod
+    def get_source(status_code=200, body=None, text=""):
+        transport = MagicMock()
+        response = transport.request.return_value
+        response.status_code, response.headers, response.text = status_code, {}, text
+        response.json.return_value = body
+        return GitHubContentsSource(access_token="token", client=GitHubClient(transport=transport)), transport
+
+    def test_candidate_files(self):
+        source, transport = self.get_source(body=[
+            {'name': 'identity.txt', 'type': 'file', 'size': 60},
+            {'name': 'data.bin', 'type': 'file', 'size': 4096},
+            {'name': 'src', 'type': 'dir', 'size': 0},
+        ])
+
+        self.assertEqual(['identity.txt'], source.candidate_files(self.repo))
+        method, url = transport.request.call_args.args
+        self.assertEqual("https://api.github.com/repos/ucl-cs-diamant/test-assignment-alice/contents/", url)
+        self.assertEqual({'ref': 'main'}, transport.request.call_args.kwargs['params'])
+        self.assertEqual("token token", transport.request.call_args.kwargs['headers']['Authorization'])
+
+    def test_empty_repository(self):
+        source, _ = self.get_source(status_code=404)
+        self.assertEqual([], source.candidate_files(self.repo))
+
+    def test_read_file(self):
+        source, transport = self.get_source(text="Student number: 1001\n")
+
+        self.assertEqual("Student number: 1001\n", source.read_file(self.repo, "identity.txt"))
+        self.assertEqual("application/vnd.github.v3.raw", transport.request.call_args.kwargs['headers']['Accept'])
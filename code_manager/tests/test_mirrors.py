@@ -0,0 +1,97 @@
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from git import Repo
+
+from code_manager import mirrors
+
+
+def commit_file(repo: Repo, filename, content):
+    with open(os.path.join(repo.working_tree_dir, filename), 'w') as outfile:
+        outfile.write(content)
+    repo.index.add([filename])
+    return repo.index.commit(f"update {filename}")
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class MirrorTest(TestCase):
+    def setUp(self) -> None:
+        self.mirror_root = tempfile.TemporaryDirectory()
+        self.source_dir = tempfile.TemporaryDirectory()
+        self.source = Repo.init(self.source_dir.name)
+        commit_file(self.source, 'main.py', "print('hello')\n")
+        self.settings_override = override_settings(REPOSITORY_MIRROR_ROOT=self.mirror_root.name)
+        self.settings_override.enable()
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        self.mirror_root.cleanup()
+        self.source_dir.cleanup()
+
+    def test_create_mirror(self):
+        mirror = mirrors.update_mirror(self.source_dir.name)
+
+        self.assertTrue(mirror.bare)
+        self.assertEqual(self.source.head.commit.hexsha, mirror.head.commit.hexsha)
+        self.assertEqual(str(mirrors.get_mirror_path(self.source_dir.name)), mirror.git_dir)
+
+    def test_incremental_fetch(self):
+        mirror_inode = os.stat(mirrors.update_mirror(self.source_dir.name).git_dir).st_ino
+        self.source.create_head('feature')
+        new_commit = commit_file(self.source, 'bot.py', "pass\n")
+
+        mirror = mirrors.update_mirror(self.source_dir.name)
+        self.assertEqual(mirror_inode, os.stat(mirror.git_dir).st_ino)  # updated in place, not re-cloned
+
+        self.assertEqual(new_commit.hexsha, mirror.head.commit.hexsha)
+        self.assertIn('feature', [head.name for head in mirror.heads])
+
+    def test_deleted_branches_pruned(self):
+        self.source.create_head('scratch')
+        mirrors.update_mirror(self.source_dir.name)
+        self.source.delete_head('scratch')
+
+        mirror = mirrors.update_mirror(self.source_dir.name)
+        self.assertNotIn('scratch', [head.name for head in mirror.heads])
+
+    def test_remote_heads(self):
+        self.source.create_head('feature')
+        heads = mirrors.get_remote_heads(self.source_dir.name)
+        self.assertEqual({self.source.active_branch.name: self.source.head.commit.hexsha,
+                          'feature': self.source.head.commit.hexsha}, heads)
+
+    def test_token_not_stored(self):
+        with patch.dict(os.environ, {'GITHUB_API_TOKEN': 'secret'}):
+            mirror = mirrors.update_mirror(self.source_dir.name)
+        with open(os.path.join(mirror.git_dir, 'config')) as config:
+            self.assertNotIn('secret', config.read())
+
+    def test_prune_lru(self):
+        other_dir = tempfile.TemporaryDirectory()
+        commit_file(Repo.init(other_dir.name), 'main.py', "print('other')\n")
+
+        old_mirror = mirrors.update_mirror(self.source_dir.name)
+        os.utime(old_mirror.git_dir, (0, 0))
+        new_mirror = mirrors.update_mirror(other_dir.name)
+
+        deleted = mirrors.prune_mirrors(max_bytes=mirrors.get_directory_size(new_mirror.git_dir))
+        self.assertEqual([mirrors.get_mirror_path(self.source_dir.name)], deleted)
+        self.assertTrue(os.path.exists(new_mirror.git_dir))
+        self.assertEqual([], mirrors.prune_mirrors(max_bytes=10 ** 12))
+        other_dir.cleanup()
+
+    def test_prune_skips_locked(self):
+        mirror = mirrors.update_mirror(self.source_dir.name)
+        with mirrors.mirror_lock(mirrors.get_mirror_path(self.source_dir.name)):
+            self.assertEqual([], mirrors.prune_mirrors(max_bytes=0))
+        self.assertTrue(os.path.exists(mirror.git_dir))
+
+    def test_prune_skips_mirrors_in_use(self):
+        with mirrors.mirror_in_use(self.source_dir.name):
+            mirror = mirrors.update_mirror(self.source_dir.name)
+            # the update lock is released, the mirror is still being read
+            self.assertEqual([], mirrors.prune_mirrors(max_bytes=0))
+            self.assertTrue(os.path.exists(mirror.git_dir))
+        self.assertEqual([mirrors.get_mirror_path(self.source_dir.name)], mirrors.prune_mirrors(max_bytes=0))
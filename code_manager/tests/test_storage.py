@@ -0,0 +1,57 @@
+import hashlib
+import hmac
+import tempfile
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import TestCase, override_settings
+
+from code_manager.storage import get_code_storage, presigned_url
+
+
+class SigningStorage(FileSystemStorage):
+    """
+    Local stand-in for an S3-compatible object store: objects live on the file system, and `url` signs query strings
+    the way S3Boto3Storage does.
+    """
+    querystring_auth = True
+    endpoint_url = "http://objects.test"
+    secret_key = b"secret"
+
+    def url(self, name, parameters=None, expire=None):
+        query = {**(parameters or {}), 'Expires': expire}
+        signature = hmac.new(self.secret_key, f"{name}?{urlencode(query)}".encode(), hashlib.sha256).hexdigest()
+        return f"{self.endpoint_url}/{name}?{urlencode({**query, 'Signature': signature})}"
+
+
+class StorageTest(TestCase):
+    def setUp(self) -> None:
+        self.media_root = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.media_root.cleanup()
+
+    def test_configured_backend(self):
+        with override_settings(CODE_STORAGE_BACKEND="code_manager.tests.test_storage.SigningStorage",
+                               CODE_STORAGE_OPTIONS={'location': self.media_root.name}):
+            storage = get_code_storage()
+
+        self.assertIsInstance(storage, SigningStorage)
+        self.assertEqual("blob.tar.gz", storage.save("blob.tar.gz", ContentFile(b"archive")))
+        self.assertEqual(7, storage.size("blob.tar.gz"))
+
+    def test_presigned_url(self):
+        storage = SigningStorage(location=self.media_root.name)
+
+        url = urlsplit(presigned_url(storage, "blobs/ab/blob.tar.gz", 60, "blob.tar", "gzip"))
+        query = parse_qs(url.query)
+
+        self.assertEqual("/blobs/ab/blob.tar.gz", url.path)
+        self.assertEqual(["60"], query['Expires'])
+        self.assertEqual(["gzip"], query['ResponseContentEncoding'])
+        self.assertEqual(["attachment; filename=blob.tar"], query['ResponseContentDisposition'])
+        self.assertIn('Signature', query)
+
+    def test_unsigned_storage(self):
+        self.assertIsNone(presigned_url(FileSystemStorage(location=self.media_root.name), "blob.tar.gz", 60))
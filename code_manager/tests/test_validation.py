@@ -0,0 +1,116 @@
+import gzip
+import io
+import os
+import tarfile
+import tempfile
+from unittest.mock import patch
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from git import Repo
+
+import code_manager.tasks
+from code_manager.validation import validate_code_archive
+from game_engine.models import User, UserCode
+
+
+def make_archive(files, symlinks=None):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, io.BytesIO(content))
+        for name, target in (symlinks or {}).items():
+            info = tarfile.TarInfo(name)
+            info.type, info.linkname = tarfile.SYMTYPE, target
+            tar.addfile(info)
+    return buffer.getvalue()
+
+
+class ValidateArchiveTest(SimpleTestCase):
+    def setUp(self) -> None:
+        self.root = tempfile.TemporaryDirectory()
+        self.storage = FileSystemStorage(location=self.root.name)
+
+    def tearDown(self) -> None:
+        self.root.cleanup()
+
+    def validate(self, content, codec='none'):
+        name = self.storage.save("archive", ContentFile(content))
+        return validate_code_archive(self.storage, name, codec)
+
+    def test_valid(self):
+        archive = make_archive({'main.py': b"import bot\n", 'bot/__init__.py': b"x = 1\n", 'README.md': b"# bot"})
+        self.assertEqual([], self.validate(archive))
+        self.assertEqual([], self.validate(gzip.compress(archive), codec='gzip'))
+
+    def test_missing_entry_point(self):
+        self.assertEqual(["missing entry point main.py"], self.validate(make_archive({'bot.py': b"pass\n"})))
+
+    def test_syntax_error(self):
+        errors = self.validate(make_archive({'main.py': b"import bot\n", 'bot.py': b"def broken(:\n"}))
+        self.assertEqual(1, len(errors))
+        self.assertTrue(errors[0].startswith("bot.py: "))
+
+    def test_unsafe_paths(self):
+        errors = self.validate(make_archive({'main.py': b"pass\n", '../escape.py': b"pass\n"},
+                                            symlinks={'link': '/etc/passwd'}))
+        self.assertEqual(["../escape.py: path outside of the code directory",
+                          "link: path outside of the code directory"], errors)
+
+    def test_corrupt(self):
+        self.assertTrue(self.validate(b"not a tar" * 100)[0].startswith("corrupt archive"))
+        self.assertTrue(self.validate(b"not gzip" * 100, codec='gzip')[0].startswith("corrupt archive"))
+
+    def test_warnings_do_not_block(self):
+        # every file warns while compiling, far more output than a pipe buffer holds
+        files = {f"bot/module_{i}.py": b"x = 2\nif x is 1:\n    pass\n" for i in range(1500)}
+        archive = make_archive({'main.py': b"import bot\n", **files})
+        with patch.dict(os.environ, {'CODE_VALIDATION_TIMEOUT': '20'}):
+            self.assertEqual([], self.validate(archive))
+
+    def test_size_limits(self):
+        archive = make_archive({'main.py': b"#" * 2000})
+        with patch.dict(os.environ, {'CODE_MAX_UNPACKED_BYTES': '1000'}):
+            self.assertEqual(["more than 1000 bytes unpacked"], self.validate(archive))
+        with patch.dict(os.environ, {'CODE_MAX_ARCHIVE_BYTES': '1000'}):
+            self.assertEqual([f"archive is {len(archive)} bytes, more than 1000"], self.validate(archive))
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class IngestionValidationTest(TestCase):
+    def test_broken_code_flagged(self):
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as source_dir, \
+                override_settings(MEDIA_ROOT=media_root):
+            source = Repo.init(source_dir)
+            with open(os.path.join(source_dir, 'main.py'), 'w') as outfile:
+                outfile.write("print('unterminated\n")
+            source.index.add(['main.py'])
+            source.index.commit("Broken commit")
+            source.create_remote('origin', source_dir).fetch()
+
+            user = User.objects.create(student_id=1, github_username="student")
+            code_manager.tasks.create_or_update_user_code(branch=(source.active_branch.name,) * 2, repo=source,
+                                                          user_instance=user)
+
+            code = UserCode.objects.get(user=user)
+            self.assertTrue(code.has_failed)
+            self.assertTrue(code.validation_error.startswith("main.py: "))
+            UserCode.objects.filter(pk=code.pk).update(consecutive_failures=4, quarantined_until=timezone.now())
+
+            with open(os.path.join(source_dir, 'main.py'), 'w') as outfile:
+                outfile.write("print('fixed')\n")
+            source.index.add(['main.py'])
+            source.index.commit("Fix")
+            source.remotes.origin.fetch()
+            code_manager.tasks.create_or_update_user_code(branch=(source.active_branch.name,) * 2, repo=source,
+                                                          user_instance=user)
+
+            code.refresh_from_db()
+            self.assertFalse(code.has_failed)
+            self.assertEqual("", code.validation_error)
+            self.assertEqual(0, code.consecutive_failures)  # new commits are released from quarantine
+            self.assertIsNone(code.quarantined_until)
@@ -0,0 +1,90 @@
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+import code_manager.tasks
+from code_manager.models import Repository
+from code_manager.tests.test_code_manager import ParallelIngestionTest
+from game_engine.models import User, UserCode, UserPerformance
+
+SECRET = "webhook-secret"
+
+
+@patch.dict(os.environ, {'GITHUB_WEBHOOK_SECRET': SECRET})
+class PushWebhookTest(TestCase):
+    @staticmethod
+    def push_payload(ref="refs/heads/main", name="test-sample-code-student", **kwargs):
+        return {'ref': ref, 'after': 'a' * 40,
+                'repository': {'name': name, 'clone_url': f"https://github.com/ucl-cs-diamant/{name}.git"},
+                **kwargs}
+
+    def post(self, payload, event="push", secret=SECRET):
+        body = json.dumps(payload).encode()
+        signature = f"sha256={hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()}"
+        return self.client.post("/api/code_manager/github_push", body, content_type="application/json",
+                                HTTP_X_GITHUB_EVENT=event, HTTP_X_HUB_SIGNATURE_256=signature)
+
+    def test_push_queues_branch(self):
+        with patch('code_manager.tasks.ingest_branch.delay') as delay_mock:
+            response = self.post(self.push_payload())
+
+        self.assertEqual(202, response.status_code)
+        delay_mock.assert_called_once_with("test-sample-code-student",
+                                           "https://github.com/ucl-cs-diamant/test-sample-code-student.git",
+                                           "main", 'a' * 40)
+
+    def test_bad_signature(self):
+        with patch('code_manager.tasks.ingest_branch.delay') as delay_mock:
+            response = self.post(self.push_payload(), secret="wrong-secret")
+            unsigned = self.client.post("/api/code_manager/github_push", self.push_payload(),
+                                        content_type="application/json", HTTP_X_GITHUB_EVENT="push")
+
+        self.assertEqual(403, response.status_code)
+        self.assertEqual(403, unsigned.status_code)
+        delay_mock.assert_not_called()
+
+    def test_ignored_pushes(self):
+        payloads = [(self.push_payload(), "ping"),
+                    (self.push_payload(ref="refs/tags/v1"), "push"),
+                    (self.push_payload(deleted=True), "push"),
+                    (self.push_payload(name="bot-template"), "push")]
+        with patch('code_manager.tasks.ingest_branch.delay') as delay_mock:
+            for payload, event in payloads:
+                self.assertEqual(200, self.post(payload, event=event).status_code)
+        delay_mock.assert_not_called()
+
+    def test_malformed_payload(self):
+        self.assertEqual(400, self.post({'ref': "refs/heads/main"}).status_code)
+
+    def test_missing_secret(self):
+        with patch.dict(os.environ, {'GITHUB_WEBHOOK_SECRET': ''}):
+            self.assertEqual(500, self.post(self.push_payload()).status_code)
+
+
+@patch.dict(os.environ, {'GITHUB_API_TOKEN_USER': 'user', 'GITHUB_API_TOKEN': 'token'})
+class IngestBranchTest(TestCase):
+    def test_ingest_branch(self):
+        with tempfile.TemporaryDirectory() as media_root, tempfile.TemporaryDirectory() as mirror_root, \
+                tempfile.TemporaryDirectory() as source_dir, \
+                override_settings(MEDIA_ROOT=media_root, REPOSITORY_MIRROR_ROOT=mirror_root):
+            source = ParallelIngestionTest.create_local_repo(source_dir)
+            user = User.objects.create(student_id=1, github_username="student")
+
+            code_manager.tasks.ingest_branch("test-sample-code-student", source_dir, source.active_branch.name)
+
+            code = UserCode.objects.get(user=user)
+            self.assertTrue(code.primary)
+            self.assertEqual(source.head.commit.hexsha, code.commit_sha)
+            self.assertTrue(UserPerformance.objects.filter(code=code).exists())
+            repository = Repository.objects.get(clone_url=source_dir)
+            self.assertEqual({source.active_branch.name: source.head.commit.hexsha}, repository.branch_heads)
+
+    def test_unknown_user(self):
+        with patch('code_manager.tasks.update_mirror') as mirror_mock:
+            code_manager.tasks.ingest_branch("test-sample-code-nobody", "https://example.com/repo.git", "main")
+        mirror_mock.assert_not_called()
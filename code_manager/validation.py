@@ -0,0 +1,73 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from code_manager.compression import decompress_chunks
+
+CODE_ENTRY_POINT = "main.py"
+VALIDATOR_PATH = Path(__file__).resolve().with_name("validator.py")
+
+
+def validate_code_archive(storage, name: str, codec: str):
+    """
+    Cheap static checks run on every archived code before it can be matched: archive integrity, the entry point,
+    byte-compilation of every Python file and size limits. The archive is parsed by `validator.py` in a subprocess
+    with memory, CPU and wall clock limits, so a broken (or hostile) archive can't take the ingestion worker down.
+
+    :param storage: storage backend holding the archive
+    :param name: storage name of the archive
+    :param codec: compression of the archive, see compression.py
+    :return: list of problems found, empty if the code passed
+    """
+    max_archive_bytes = int(os.environ.get("CODE_MAX_ARCHIVE_BYTES", 50 * 1024 ** 2))
+    if (archive_size := storage.size(name)) > max_archive_bytes:
+        return [f"archive is {archive_size} bytes, more than {max_archive_bytes}"]
+
+    timeout = float(os.environ.get("CODE_VALIDATION_TIMEOUT", 30))
+    process = subprocess.Popen([sys.executable, "-I", str(VALIDATOR_PATH),
+                                CODE_ENTRY_POINT,
+                                os.environ.get("CODE_MAX_UNPACKED_BYTES", str(200 * 1024 ** 2)),
+                                os.environ.get("CODE_MAX_FILES", "10000"),
+                                os.environ.get("CODE_VALIDATION_MEMORY_BYTES", str(512 * 1024 ** 2)),
+                                str(int(timeout))],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               cwd="/", env={})
+    killer = threading.Timer(timeout, process.kill)  # wall clock limit, on top of the CPU limit
+    killer.start()
+    # drained while the archive is written, compile warnings would otherwise fill the pipe and block both processes
+    outputs = []
+    reader = threading.Thread(target=lambda: outputs.append(process.stdout.read()), daemon=True)
+    reader.start()
+    chunks = decompress_chunks(storage.open(name, 'rb'), codec)
+    try:
+        try:
+            for chunk in chunks:
+                process.stdin.write(chunk)
+            process.stdin.close()
+        except OSError:  # the validator stopped reading, e.g. it hit a size limit
+            pass
+        except Exception as e:  # the compressed stream itself is corrupt
+            process.kill()
+            process.wait()
+            reader.join()
+            return [f"corrupt archive: {e!r}"]
+        process.wait()
+        reader.join()
+        output = b"".join(outputs)
+    finally:
+        killer.cancel()
+        chunks.close()
+        for pipe in (process.stdin, process.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    try:
+        return json.loads(output.splitlines()[-1])['errors']  # the result is the last line, after any warnings
+    except (ValueError, KeyError, TypeError, IndexError):
+        print(f"validator failed on {name} with exit code {process.returncode}: {output.decode(errors='replace')}")
+        return [f"validation aborted (exit code {process.returncode}), the archive may exceed resource limits"]
@@ -0,0 +1,70 @@
+"""
+Checks a code archive, read as an uncompressed tar stream from stdin, without extracting it.
+
+Run by `code_manager.validation` as a separate process under resource limits, so a malformed or malicious archive can
+only exhaust that process. Only depends on the standard library, it runs in isolated mode.
+
+usage: python -I validator.py <entry point> <max unpacked bytes> <max files> <max memory bytes> <max cpu seconds>
+prints {"errors": [...]} as JSON, an empty list meaning the archive passed
+"""
+import json
+import resource
+import sys
+import tarfile
+from pathlib import PurePosixPath
+
+
+def limit_resources(max_memory_bytes: int, max_cpu_seconds: int):
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+    resource.setrlimit(resource.RLIMIT_CPU, (max_cpu_seconds, max_cpu_seconds))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))  # nothing is ever written to disk
+
+
+def unsafe_path(name: str) -> bool:
+    path = PurePosixPath(name)
+    return path.is_absolute() or '..' in path.parts
+
+
+def validate(archive, entry_point: str, max_unpacked_bytes: int, max_files: int):
+    errors = []
+    unpacked_bytes = 0
+    found_entry_point = False
+    try:
+        with tarfile.open(fileobj=archive, mode='r|') as tar:  # streamed, members are read once, in order
+            for file_count, member in enumerate(tar, start=1):
+                name = member.name[2:] if member.name.startswith('./') else member.name
+                if file_count > max_files:
+                    errors.append(f"more than {max_files} files")
+                    break
+                if unsafe_path(name) or ((member.issym() or member.islnk()) and unsafe_path(member.linkname)):
+                    errors.append(f"{name}: path outside of the code directory")
+                    continue
+                unpacked_bytes += member.size
+                if unpacked_bytes > max_unpacked_bytes:
+                    errors.append(f"more than {max_unpacked_bytes} bytes unpacked")
+                    break
+                if not member.isfile():
+                    continue
+
+                found_entry_point |= name == entry_point
+                if name.endswith('.py'):
+                    try:
+                        compile(tar.extractfile(member).read(), name, 'exec', dont_inherit=True)
+                    except (SyntaxError, ValueError) as e:
+                        errors.append(f"{name}: {e}")
+    except (tarfile.TarError, EOFError, OSError) as e:
+        return errors + [f"corrupt archive: {e}"]
+
+    if not found_entry_point and not any(error.startswith("more than") for error in errors):
+        errors.append(f"missing entry point {entry_point}")
+    return errors
+
+
+def main(entry_point, max_unpacked_bytes, max_files, max_memory_bytes, max_cpu_seconds):
+    limit_resources(int(max_memory_bytes), int(max_cpu_seconds))
+    errors = validate(sys.stdin.buffer, entry_point, int(max_unpacked_bytes), int(max_files))
+    print(json.dumps({'errors': errors}))
+
+
+if __name__ == '__main__':
+    main(*sys.argv[1:])
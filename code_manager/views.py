@@ -1,3 +1,55 @@
-from django.shortcuts import render
+import hashlib
+import hmac
+import json
+import os
 
-# Create your views here.
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_http_methods
+from rest_framework import status
+
+from code_manager.tasks import CODE_REPOSITORY_PREFIX, ingest_branch
+
+
+def signature_valid(secret: str, body: bytes, signature: str) -> bool:
+    # see https://docs.github.com/en/developers/webhooks-and-events/webhooks/securing-your-webhooks
+    expected = f"sha256={hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()}"
+    return hmac.compare_digest(expected, signature)
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def github_push(request):
+    """
+    GitHub push webhook: queues ingestion of the pushed branch only, instead of waiting for the next full sync.
+    Payloads are authenticated with the X-Hub-Signature-256 HMAC of the shared GITHUB_WEBHOOK_SECRET.
+    """
+    secret = os.environ.get('GITHUB_WEBHOOK_SECRET')
+    if not secret:
+        return JsonResponse({'ok': False, 'message': 'Misconfigured server, missing webhook secret.'},
+                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    if not signature_valid(secret, request.body, request.headers.get('X-Hub-Signature-256', '')):
+        return JsonResponse({'ok': False, 'message': 'invalid signature'}, status=status.HTTP_403_FORBIDDEN)
+
+    event = request.headers.get('X-GitHub-Event')
+    if event == 'ping':
+        return JsonResponse({'ok': True, 'message': 'pong'})
+    if event != 'push':
+        return JsonResponse({'ok': True, 'message': f'ignoring {event} event'})
+
+    try:
+        payload = json.loads(request.body)
+        ref = payload['ref']
+        repo_name, clone_url = payload['repository']['name'], payload['repository']['clone_url']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'ok': False, 'message': 'malformed push payload'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not ref.startswith('refs/heads/') or payload.get('deleted'):
+        return JsonResponse({'ok': True, 'message': 'ignoring push, not a branch update'})
+    if not repo_name.startswith(CODE_REPOSITORY_PREFIX):
+        return JsonResponse({'ok': True, 'message': 'ignoring push, not a code repository'})
+
+    branch_name = ref[len('refs/heads/'):]
+    ingest_branch.delay(repo_name, clone_url, branch_name, payload.get('after'))
+    return JsonResponse({'ok': True, 'message': f'queued ingestion of {repo_name} {branch_name}'},
+                        status=status.HTTP_202_ACCEPTED)
@@ -1,9 +1,11 @@
 from django.contrib import admin
-from game_engine.models import Match, User, UserCode, MatchResult, UserPerformance, UserSettings
+from game_engine.models import Match, User, UserCode, MatchResult, UserPerformance, UserSettings, \
+    MatchParticipant
 
 # Register your models here.
 admin.site.register(Match)
 admin.site.register(MatchResult)
+admin.site.register(MatchParticipant)
 admin.site.register(User)
 admin.site.register(UserCode)
 admin.site.register(UserPerformance)
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0023_alter_usersettings_display_name'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userperformance',
+            index=models.Index(fields=['mmr', 'id'], name='userperformance_mmr_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0024_userperformance_mmr_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='matchresult',
+            index=models.Index(fields=['time_finished', 'id'], name='matchresult_finished_id_idx'),
+        ),
+    ]
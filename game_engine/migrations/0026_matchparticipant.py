@@ -0,0 +1,36 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0025_matchresult_time_finished_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MatchParticipant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('won', models.BooleanField(default=False)),
+                ('mmr_before', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('confidence_before', models.DecimalField(decimal_places=7, max_digits=12, null=True)),
+                ('mmr_after', models.DecimalField(decimal_places=6, max_digits=12, null=True)),
+                ('confidence_after', models.DecimalField(decimal_places=7, max_digits=12, null=True)),
+                ('code', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game_engine.usercode')),
+                ('match_result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='participants', to='game_engine.matchresult')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='game_engine.user')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='matchparticipant',
+            index=models.Index(fields=['user', 'match_result'], name='participant_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='matchparticipant',
+            index=models.Index(fields=['code', 'match_result'], name='participant_code_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:34
+
+from django.db import migrations
+
+
+def backfill_participants(apps, _):
+    MatchResult = apps.get_model('game_engine', 'MatchResult')
+    MatchParticipant = apps.get_model('game_engine', 'MatchParticipant')
+    UserCode = apps.get_model('game_engine', 'UserCode')
+
+    code_owners = dict(UserCode.objects.values_list('pk', 'user_id'))
+    participants = []
+    for match_result in MatchResult.objects.only('pk', 'players', 'winners').iterator():
+        for code_id in match_result.players:
+            if code_id not in code_owners:  # code has since been deleted
+                continue
+            participants.append(MatchParticipant(match_result_id=match_result.pk,
+                                                 code_id=code_id,
+                                                 user_id=code_owners[code_id],
+                                                 won=code_id in match_result.winners))
+        if len(participants) >= 1000:
+            MatchParticipant.objects.bulk_create(participants)
+            participants = []
+    MatchParticipant.objects.bulk_create(participants)
+
+
+def remove_participants(apps, _):
+    apps.get_model('game_engine', 'MatchParticipant').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0026_matchparticipant'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_participants, remove_participants),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0027_backfill_matchparticipant'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercode',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
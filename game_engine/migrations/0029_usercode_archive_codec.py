@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0028_usercode_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercode',
+            name='archive_codec',
+            field=models.CharField(default='none', max_length=8),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0029_usercode_archive_codec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercode',
+            name='validation_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0030_usercode_validation_error'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercode',
+            name='consecutive_failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usercode',
+            name='quarantined_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
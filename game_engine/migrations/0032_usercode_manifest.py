@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0031_usercode_quarantine'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usercode',
+            name='archive_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='usercode',
+            name='updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='usercode',
+            index=models.Index(fields=['updated_at', 'id'], name='usercode_updated_id_idx'),
+        ),
+    ]
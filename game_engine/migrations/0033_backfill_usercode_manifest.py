@@ -0,0 +1,31 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:20
+
+from django.db import migrations
+
+
+def backfill_manifest_fields(apps, _):
+    UserCode = apps.get_model('game_engine', 'UserCode')
+
+    codes = []
+    for code in UserCode.objects.exclude(source_code='').only('pk', 'source_code', 'commit_time').iterator():
+        try:
+            code.archive_size = code.source_code.size
+        except OSError:  # archive missing from storage
+            continue
+        code.updated_at = code.commit_time
+        codes.append(code)
+        if len(codes) >= 1000:
+            UserCode.objects.bulk_update(codes, ['archive_size', 'updated_at'])
+            codes = []
+    UserCode.objects.bulk_update(codes, ['archive_size', 'updated_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0032_usercode_manifest'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_manifest_fields, migrations.RunPython.noop),
+    ]
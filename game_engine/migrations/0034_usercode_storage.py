@@ -0,0 +1,20 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:01
+
+import code_manager.storage
+from django.db import migrations, models
+import game_engine.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0033_backfill_usercode_manifest'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='usercode',
+            name='source_code',
+            field=models.FileField(storage=code_manager.storage.get_code_storage, upload_to=game_engine.models.get_filename),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('game_engine', '0034_usercode_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='match',
+            name='games',
+            field=models.PositiveSmallIntegerField(default=1),
+        ),
+    ]
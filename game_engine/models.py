@@ -7,6 +7,8 @@ from django.utils import timezone
 
 from jsonfield import JSONField
 
+from code_manager.storage import get_code_storage
+
 
 def hex_token(n_bytes=16):
     a = secrets.token_hex(nbytes=n_bytes)
@@ -48,7 +50,7 @@ class UserSettings(models.Model):
 
 class UserCode(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    source_code = models.FileField(upload_to=get_filename)
+    source_code = models.FileField(upload_to=get_filename, storage=get_code_storage)
     branch = models.CharField(max_length=255)
 
     to_clone = models.BooleanField(default=False)  # tells us if we want to clone and run this branch
@@ -56,10 +58,23 @@ class UserCode(models.Model):
 
     commit_time = models.DateTimeField()
     commit_sha = models.CharField(max_length=41)
+    content_hash = models.CharField(max_length=64, blank=True, default="")  # identifies source_code's blob
+    archive_codec = models.CharField(max_length=8, default="none")  # compression of source_code, see compression.py
 
     has_failed = models.BooleanField(default=False)
+    validation_error = models.TextField(blank=True, default="")  # why ingestion-time validation set has_failed
+    # failures reported by runners since the last completed match, each one doubles the quarantine
+    consecutive_failures = models.IntegerField(default=0)
+    quarantined_until = models.DateTimeField(null=True, blank=True)  # kept out of matchmaking until then
     is_in_game = models.BooleanField(default=False)
 
+    archive_size = models.PositiveBigIntegerField(default=0)
+    # last time a new archive was stored (and validated), drives the runners' delta sync
+    updated_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['updated_at', 'id'], name='usercode_updated_id_idx')]
+
 
 class UserPerformance(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)  # not strictly needed I guess?
@@ -69,6 +84,10 @@ class UserPerformance(models.Model):
     games_played = models.IntegerField(default=0)
     league = models.IntegerField(default=0)
 
+    class Meta:
+        # leaderboard order, lets rank lookups seek instead of scanning the table
+        indexes = [models.Index(fields=['mmr', 'id'], name='userperformance_mmr_id_idx')]
+
 
 # takes a list of user IDs
 class MatchPlayersField(models.TextField):
@@ -99,6 +118,7 @@ class Match(models.Model):
     in_progress = models.BooleanField(default=False)
     over = models.BooleanField(default=False)
     players = MatchPlayersField()
+    games = models.PositiveSmallIntegerField(default=1)  # games of the series played back to back by one runner
 
     class Meta:
         verbose_name_plural = _("Matches")
@@ -113,3 +133,24 @@ class MatchResult(models.Model):
 
     class Meta:
         verbose_name_plural = _("Match results")
+        indexes = [models.Index(fields=['time_finished', 'id'], name='matchresult_finished_id_idx')]
+
+
+class MatchParticipant(models.Model):
+    """
+    One row per code taking part in a finished match, so a player's history is an index lookup rather than a search
+    through MatchResult.players. Ratings are null for rows backfilled from results recorded before this table existed.
+    """
+    match_result = models.ForeignKey(MatchResult, on_delete=models.CASCADE, related_name='participants')
+    code = models.ForeignKey(UserCode, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    won = models.BooleanField(default=False)
+
+    mmr_before = models.DecimalField(max_digits=12, decimal_places=6, null=True)
+    confidence_before = models.DecimalField(max_digits=12, decimal_places=7, null=True)
+    mmr_after = models.DecimalField(max_digits=12, decimal_places=6, null=True)
+    confidence_after = models.DecimalField(max_digits=12, decimal_places=7, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'match_result'], name='participant_user_idx'),
+                   models.Index(fields=['code', 'match_result'], name='participant_code_idx')]
@@ -0,0 +1,151 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models import Model, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on the queryset's ordering, with `pk` appended as a tie-breaker in the direction of the
+    last ordering field, so an index on (field, id) can serve the ordering without a sort.
+
+    Each page is fetched with a range filter starting at the boundary row of the previous page rather than with an
+    OFFSET, and no COUNT is issued, so deep pages cost the same as the first one. Because the cursor holds the
+    boundary row's key values rather than a position, rows moving around elsewhere in the ordering (e.g. ratings
+    changing while someone browses the leaderboard) don't make the following page skip or repeat rows.
+    Ordering fields must be non-nullable.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    default_ordering = ('-pk',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def __init__(self):
+        self.request = None
+        self.base_url = None
+        self.keys = []
+        self.next_position = None
+        self.previous_position = None
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_keys(self, queryset):
+        """
+        :return: list of (field name, descending) pairs, ending with `pk`
+        """
+        ordering = [field for field in queryset.query.order_by if isinstance(field, str)] \
+            or list(self.default_ordering)
+        keys = [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+        if keys[-1][0] not in ('pk', 'id'):
+            keys.append(('pk', keys[-1][1]))  # mixed directions can't be read off a single index
+        return keys
+
+    @staticmethod
+    def order_by(keys, reverse):
+        return [f"{'-' if descending != reverse else ''}{field}" for field, descending in keys]
+
+    @staticmethod
+    def position_filter(keys, position, reverse):
+        # lexicographic "comes after `position`": (a > x) or (a = x and b > y) or ...
+        clauses = Q()
+        equal_to = {}
+        for (field, descending), value in zip(keys, position):
+            lookup = 'lt' if descending != reverse else 'gt'
+            clauses |= Q(**equal_to, **{f"{field}__{lookup}": value})
+            equal_to[field] = value
+        return clauses
+
+    def get_position(self, obj):
+        position = []
+        for field, _ in self.keys:
+            value = obj
+            for attribute in field.split('__'):
+                value = getattr(value, attribute)
+            position.append(value.pk if isinstance(value, Model) else value)
+        return position
+
+    def decode_cursor(self, request):
+        """
+        :return: None if no cursor was passed, else 2-tuple: (boundary row key values, reverse)
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(encoded.encode('ascii')))
+            position, reverse = cursor['p'], bool(cursor['r'])
+        except (binascii.Error, UnicodeError, ValueError, TypeError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.keys):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def encode_cursor(self, position, reverse):
+        cursor = json.dumps({'p': position, 'r': int(reverse)}, default=str, separators=(',', ':'))
+        encoded = base64.urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.keys = self.get_keys(queryset)
+        page_size = self.get_page_size(request)
+
+        cursor = self.decode_cursor(request)
+        position, reverse = cursor if cursor is not None else (None, False)
+
+        queryset = queryset.order_by(*self.order_by(self.keys, reverse))
+        if position is not None:
+            queryset = queryset.filter(self.position_filter(self.keys, position, reverse))
+
+        results = list(queryset[:page_size + 1])  # fetch one extra row to tell whether there is more
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+
+        has_next, has_previous = (position is not None, has_more) if reverse else (has_more, position is not None)
+        self.next_position = (self.get_position(results[-1]) if results else position) if has_next else None
+        self.previous_position = (self.get_position(results[0]) if results else position) if has_previous else None
+        return results
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return self.encode_cursor(self.next_position, reverse=False)
+
+    def get_previous_link(self):
+        if self.previous_position is None:
+            return None
+        return self.encode_cursor(self.previous_position, reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
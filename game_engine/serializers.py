@@ -1,10 +1,46 @@
 from game_engine.models import Match, User, UserPerformance, UserCode, UserSettings
 from game_engine.models import MatchResult
 from rest_framework import serializers
+from urllib.parse import quote
 import os
 
 
-class MatchResultSerializer(serializers.HyperlinkedModelSerializer):
+class CachedUrlMixin:
+    """
+    Reverses each view name once per field instance and fills the lookup value into the cached URL for every other
+    row, instead of resolving the URL from scratch for every object of a list.
+    """
+    lookup_placeholder = "__lookup__"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.url_templates = {}
+
+    def get_url(self, obj, view_name, request, format):
+        if hasattr(obj, 'pk') and obj.pk in (None, ''):
+            return None
+
+        if (template := self.url_templates.get((view_name, format))) is None:
+            template = self.reverse(view_name, kwargs={self.lookup_url_kwarg: self.lookup_placeholder},
+                                    request=request, format=format)
+            self.url_templates[(view_name, format)] = template
+        return template.replace(self.lookup_placeholder, quote(str(getattr(obj, self.lookup_field))))
+
+
+class CachedHyperlinkedRelatedField(CachedUrlMixin, serializers.HyperlinkedRelatedField):
+    pass
+
+
+class CachedHyperlinkedIdentityField(CachedUrlMixin, serializers.HyperlinkedIdentityField):
+    pass
+
+
+class CachedHyperlinkedModelSerializer(serializers.HyperlinkedModelSerializer):
+    serializer_related_field = CachedHyperlinkedRelatedField
+    serializer_url_field = CachedHyperlinkedIdentityField
+
+
+class MatchResultSerializer(CachedHyperlinkedModelSerializer):
     match_events = serializers.SerializerMethodField('load_json')
     match_id = serializers.SerializerMethodField('get_pk')
 
@@ -45,7 +81,7 @@ class MatchSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = Match
-        fields = ['game_id', 'allocated', 'in_progress', 'players', 'decision_timeout']
+        fields = ['game_id', 'allocated', 'in_progress', 'players', 'games', 'decision_timeout']
 
 
 #
@@ -55,7 +91,7 @@ class MatchSerializer(serializers.HyperlinkedModelSerializer):
 #         model = MatchResult
 
 
-class UserPerformanceSerializer(serializers.HyperlinkedModelSerializer):
+class UserPerformanceSerializer(CachedHyperlinkedModelSerializer):
     user_details = serializers.SerializerMethodField('get_user_details')
     pk = serializers.SerializerMethodField('get_pk')
 
@@ -74,13 +110,13 @@ class UserPerformanceSerializer(serializers.HyperlinkedModelSerializer):
         fields = ['pk', 'url', 'mmr', 'confidence', 'games_played', 'league', 'user', 'user_details']
 
 
-class UserSerializer(serializers.HyperlinkedModelSerializer):
+class UserSerializer(CachedHyperlinkedModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'email_address', 'github_username', 'student_id']
 
 
-class UserCodeSerializer(serializers.HyperlinkedModelSerializer):
+class UserCodeSerializer(CachedHyperlinkedModelSerializer):
     id = serializers.ReadOnlyField()
 
     class Meta:
@@ -94,7 +130,10 @@ class UserCodeSerializer(serializers.HyperlinkedModelSerializer):
                   'primary',
                   'commit_time',
                   'commit_sha',
-                  'has_failed']
+                  'has_failed',
+                  'validation_error',
+                  'consecutive_failures',
+                  'quarantined_until']
 
 
 class UserSettingsSerializer(serializers.HyperlinkedModelSerializer):
@@ -5,7 +5,8 @@ import time
 
 import trueskill
 from celery import shared_task
-from django.db.models import QuerySet
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q, QuerySet
 
 from game_engine.models import User, UserCode, Match, UserPerformance
 from django.utils import timezone
@@ -85,13 +86,26 @@ def determine_acceptable_match(match_quality, game_size, reject_count):
 
 # todo: change from scheduled task to an event driven system
 @shared_task
-def matchmake(min_game_size: int = 3, target_game_size: int = 4, min_games_in_queue: int = 8):
+def matchmake(min_game_size: int = 3, target_game_size: int = 4, min_games_in_queue: int = 8,
+              series_length: int = None):
+    """
+    Queues matches between available codes. Each match is a series of `series_length` games (MATCH_SERIES_LENGTH by
+    default) between the same players, played back to back by one runner so code downloads and container start-up
+    are paid once per series rather than once per game.
+    """
+    if series_length is None:
+        series_length = int(os.environ.get("MATCH_SERIES_LENGTH", 1))
+    if series_length < 1:
+        raise ImproperlyConfigured(f"MATCH_SERIES_LENGTH: a series needs at least 1 game, not {series_length}")
     current_ready_match_count = Match.objects.filter(allocated=None, in_progress=False, over=False).count()
     if current_ready_match_count < min_games_in_queue:
         matches_to_create = min_games_in_queue - current_ready_match_count
         matches_created = 0
         while matches_created < matches_to_create:
-            available_players = UserCode.objects.filter(has_failed=False, is_in_game=False)
+            # only the primary and enabled branches are played
+            available_players = UserCode.objects.filter(Q(to_clone=True) | Q(primary=True),
+                                                        has_failed=False, is_in_game=False) \
+                .exclude(source_code='').exclude(quarantined_until__gt=timezone.now())
             if available_players.count() < min_game_size:
                 return
 
@@ -107,6 +121,7 @@ def matchmake(min_game_size: int = 3, target_game_size: int = 4, min_games_in_qu
 
             match = Match()
             match.players = player_codes
+            match.games = series_length
             match.save()
 
             UserCode.objects.filter(pk__in=player_codes).update(is_in_game=True)
@@ -124,7 +139,7 @@ def scrub_dead_matches():
 
     in_progress_matches = Match.objects.filter(in_progress=True)
     for match in in_progress_matches:
-        if (timezone.now() - match.allocated).total_seconds() >= timeout:
+        if (timezone.now() - match.allocated).total_seconds() >= timeout * match.games:
             print(f"Match {match.pk} dead, removing.")
             user_codes = match.players
             UserCode.objects.filter(pk__in=user_codes).update(is_in_game=False)
@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+import game_engine.models as models
+from game_engine.pagination import KeysetPagination
+
+
+class KeysetPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        finished = timezone.now()
+        self.match_results = [models.MatchResult.objects.create(players=[1, 2],
+                                                                winners=[1],
+                                                                match_events=[],
+                                                                time_started=finished - timedelta(minutes=i + 1),
+                                                                time_finished=finished - timedelta(minutes=i // 2))
+                              for i in range(7)]
+        # newest first, ties on time_finished broken by descending pk
+        self.expected_order = sorted(self.match_results, key=lambda mr: (mr.time_finished, mr.pk), reverse=True)
+
+        for i in range(5):
+            user = models.User.objects.create(student_id=i, github_username=str(i), email_address=f"{i}@ucl.ac.uk")
+            code = models.UserCode.objects.create(user=user, commit_time=timezone.now(), primary=True)
+            models.UserPerformance.objects.create(user=user, code=code, mmr=25)
+
+    def collect_pages(self, url, params):
+        pages = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(200, response.status_code)
+            pages.append(response.json())
+            if pages[-1]['next'] is None:
+                return pages
+            response = self.client.get(pages[-1]['next'])
+
+    def test_forward(self):
+        pages = self.collect_pages("/api/match_history/", {'limit': 3})
+        self.assertEqual([3, 3, 1], [len(page['results']) for page in pages])
+        self.assertIsNone(pages[0]['previous'])
+        self.assertNotIn('count', pages[0])
+
+        seen = [result['match_id'] for page in pages for result in page['results']]
+        self.assertEqual([mr.pk for mr in self.expected_order], seen)
+
+    def test_backward(self):
+        pages = self.collect_pages("/api/match_history/", {'limit': 3})
+
+        response = self.client.get(pages[-1]['previous']).json()
+        self.assertEqual(pages[1]['results'], response['results'])
+        response = self.client.get(response['previous']).json()
+        self.assertEqual(pages[0]['results'], response['results'])
+        self.assertIsNone(response['previous'])
+
+    def test_no_skips_or_repeats_when_rows_move(self):
+        ordered = list(models.UserPerformance.objects.order_by('-mmr', '-pk').values_list('pk', flat=True))
+        first_page = self.client.get("/api/user_performances/", {'limit': 2}).json()
+        seen = [result['pk'] for result in first_page['results']]
+
+        # a player not yet shown gets promoted above the first page while browsing
+        models.UserPerformance.objects.filter(pk=ordered[-1]).update(mmr=30)
+
+        pages = self.collect_pages(first_page['next'], {})
+        seen += [result['pk'] for page in pages for result in page['results']]
+        self.assertEqual(ordered[:-1], seen)
+
+    def test_order_follows_index_direction(self):
+        paginator = KeysetPagination()
+        performances = models.UserPerformance.objects
+        self.assertEqual([('mmr', True), ('pk', True)], paginator.get_keys(performances.order_by('-mmr')))
+        self.assertEqual([('mmr', False), ('pk', False)], paginator.get_keys(performances.order_by('mmr')))
+
+        # the leaderboard reads the (mmr, id) index backwards, ties newest first, and agrees with rank
+        results = self.client.get("/api/user_performances/").json()['results']
+        ordered = list(models.UserPerformance.objects.order_by('-mmr', '-pk').values_list('pk', flat=True))
+        self.assertEqual(ordered, [result['pk'] for result in results])
+        for position, pk in enumerate(ordered, start=1):
+            response = self.client.get("/api/user_performances/rank/",
+                                       {'code': models.UserPerformance.objects.get(pk=pk).code_id})
+            self.assertEqual(position, response.data['rank'])
+
+    def test_constant_queries(self):
+        first_page = self.client.get("/api/match_history/", {'limit': 2}).json()
+        with self.assertNumQueries(1):
+            self.client.get(first_page['next'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get("/api/match_history/", {'cursor': 'not a cursor'})
+        self.assertEqual(404, response.status_code)
@@ -3,6 +3,7 @@ import pathlib
 import tempfile
 from datetime import timedelta
 
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
 from django.test import TestCase
 from django.core.files import File
@@ -28,7 +29,8 @@ class TestTasks(TestCase):
             user_code = models.UserCode.objects.create(
                 user=user,
                 source_code=self.mock_file.name,
-                commit_time=timezone.now()
+                commit_time=timezone.now(),
+                to_clone=True
             )
             user_performance = models.UserPerformance.objects.create(
                 user=user,
@@ -59,6 +61,30 @@ class TestTasks(TestCase):
         match = models.Match.objects.all().first()
         self.assertEqual(len(match.players), 3)
 
+    def test_match_making_skips_unarchived_codes(self):
+        models.UserCode.objects.filter(pk=self.user_code_list[0].pk).update(source_code='')
+        tasks.matchmake()
+        match = models.Match.objects.all().first()
+        self.assertNotIn(self.user_code_list[0].pk, match.players)
+
+    def test_match_making_skips_disabled_branches(self):
+        disabled, primary = self.user_code_list[0], self.user_code_list[1]
+        models.UserCode.objects.filter(pk=disabled.pk).update(to_clone=False)
+        models.UserCode.objects.filter(pk=primary.pk).update(to_clone=False, primary=True)
+        tasks.matchmake()
+        players = {player for match in models.Match.objects.all() for player in match.players}
+        self.assertNotIn(disabled.pk, players)
+        self.assertIn(primary.pk, players)
+
+    def test_match_making_skips_quarantined_codes(self):
+        quarantined, released = self.user_code_list[0], self.user_code_list[1]
+        models.UserCode.objects.filter(pk=quarantined.pk).update(quarantined_until=timezone.now() + timedelta(hours=1))
+        models.UserCode.objects.filter(pk=released.pk).update(quarantined_until=timezone.now() - timedelta(hours=1))
+        tasks.matchmake()
+        players = {player for match in models.Match.objects.all() for player in match.players}
+        self.assertNotIn(quarantined.pk, players)
+        self.assertIn(released.pk, players)
+
     def test_match_making_no_players(self):
         for user in self.user_code_list:
             user.delete()
@@ -75,6 +101,25 @@ class TestTasks(TestCase):
         self.assertFalse(models.Match.objects.all().exists())
         self.assertFalse(models.UserCode.objects.filter(is_in_game=True).exists())
 
+    def test_match_series_scrubbing(self):
+        tasks.matchmake(series_length=3)
+        self.assertEqual([3], list(models.Match.objects.values_list('games', flat=True).distinct()))
+
+        # a series gets as much time per game as a single match
+        models.Match.objects.update(in_progress=True, allocated=timezone.now() - timedelta(seconds=self.timeout + 5))
+        tasks.scrub_dead_matches()
+        self.assertTrue(models.Match.objects.exists())
+
+        models.Match.objects.update(allocated=timezone.now() - timedelta(seconds=3 * self.timeout + 5))
+        tasks.scrub_dead_matches()
+        self.assertFalse(models.Match.objects.exists())
+
+    def test_match_series_length_validated(self):
+        for series_length in ("0", "-2"):
+            with mock.patch.dict(os.environ, {"MATCH_SERIES_LENGTH": series_length}):
+                self.assertRaises(ImproperlyConfigured, tasks.matchmake)
+        self.assertFalse(models.Match.objects.exists())
+
     def test_extract_players(self):
         player_list = models.UserPerformance.objects.all().order_by('mmr')
 
@@ -0,0 +1,23 @@
+from django.test import SimpleTestCase
+
+from game_engine.utils import downsample_lttb
+
+
+class DownsampleTest(SimpleTestCase):
+    def setUp(self):
+        self.points = [(x, float(x % 7), f"label {x}") for x in range(100)]
+
+    def test_short_series_unchanged(self):
+        self.assertEqual(self.points[:5], downsample_lttb(self.points[:5], 10))
+
+    def test_threshold(self):
+        sampled = downsample_lttb(self.points, 10)
+        self.assertEqual(10, len(sampled))
+        self.assertEqual(self.points[0], sampled[0])
+        self.assertEqual(self.points[-1], sampled[-1])
+        self.assertEqual(sorted(sampled), sampled)
+
+    def test_keeps_peaks(self):
+        points = [(x, 0.0) for x in range(100)]
+        points[42] = (42, 10.0)
+        self.assertIn((42, 10.0), downsample_lttb(points, 5))
@@ -1,14 +1,24 @@
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
 from django.utils import timezone
 
+from rest_framework import relations
 from rest_framework.test import APIClient, APIRequestFactory
 
 import game_engine.views as views
 import game_engine.models as models
 
+import gzip
+import io
+import json
+import os
+import tarfile
+import mock
+import tempfile
 from decimal import Decimal
 from collections import OrderedDict
 
+from code_manager.tests.test_storage import SigningStorage
 from game_engine.serializers import UserPerformanceSerializer
 
 
@@ -29,15 +39,17 @@ def create_user_code(user_instance, is_primary=True):
     return user_code
 
 
-def create_match_result_entry(user):
-    user_match = models.MatchResult.objects.create(players=[user.pk],
-                                                   winners=[user.pk],
+def create_match_result_entry(user, user_code=None):
+    user_code = create_user_code(user) if user_code is None else user_code
+    user_match = models.MatchResult.objects.create(players=[user_code.pk],
+                                                   winners=[user_code.pk],
                                                    match_events=[],
                                                    time_started=timezone.datetime(2021, 8, 7, 18, 48, 40,
                                                                                   tzinfo=timezone.utc),
                                                    time_finished=timezone.datetime(2021, 8, 7, 18, 48, 45,
                                                                                    tzinfo=timezone.utc))
     user_match.save()
+    models.MatchParticipant.objects.create(match_result=user_match, code=user_code, user=user, won=True)
     return user_match
 
 
@@ -81,28 +93,34 @@ class TestViews(TestCase):
         response = self.client.get("/api/users/1/user_match_list", follow=True)
         self.assertEqual(response.status_code, 204)
 
+    def test_user_match_list_invalid_user(self):
+        response = self.client.get("/api/users/abc/user_match_list/")
+        self.assertEqual(400, response.status_code)
+
     def test_user_match_list(self):
         user = create_user(1)
+        user_code = create_user_code(user)
 
-        user_match = create_match_result_entry(user)
+        user_match = create_match_result_entry(user, user_code)
 
         expected = [{'match_id': user_match.pk,
                      'url': f'http://testserver/api/match_history/{user_match.pk}/',
                      'match_events': [],
-                     'players': f'[{user.pk}]',
-                     'winners': f'[{user.pk}]',
+                     'players': f'[{user_code.pk}]',
+                     'winners': f'[{user_code.pk}]',
                      'time_started': '2021-08-07T18:48:40Z',
                      'time_finished': '2021-08-07T18:48:45Z'}]
 
         response = self.client.get(f"/api/users/{user.pk}/user_match_list/", follow=True)
         self.assertEqual(response.json()['results'], expected)
-        self.assertEqual(response.json()['count'], 1)
+        self.assertNotIn('count', response.json())
         self.assertEqual(response.json()['next'], None)
         self.assertEqual(response.json()['previous'], None)
 
     def test_action_no_pagination_1(self):
         user = create_user(1)
-        user_match = create_match_result_entry(user)
+        user_code = create_user_code(user)
+        user_match = create_match_result_entry(user, user_code)
 
         factory = APIRequestFactory()
         view = views.UserViewSet.as_view({'get': 'user_match_list'}, pagination_class=None)
@@ -113,13 +131,22 @@ class TestViews(TestCase):
         expected = [{'match_id': user_match.pk,
                      'url': f'http://testserver/api/match_history/{user_match.pk}/',
                      'match_events': [],
-                     'players': f'[{user.pk}]',
-                     'winners': f'[{user.pk}]',
+                     'players': f'[{user_code.pk}]',
+                     'winners': f'[{user_code.pk}]',
                      'time_started': '2021-08-07T18:48:40Z',
                      'time_finished': '2021-08-07T18:48:45Z'}]
 
         self.assertEqual(expected, response.data)
 
+    def test_user_match_list_no_substring_matches(self):
+        user = create_user(1)
+        for student_id in range(2, 12):
+            create_match_result_entry(create_user(student_id))
+        own_match = create_match_result_entry(user)
+
+        response = self.client.get(f"/api/users/{user.pk}/user_match_list/", follow=True)
+        self.assertEqual([own_match.pk], [result['match_id'] for result in response.json()['results']])
+
     def test_user_performance_view_set_list_default(self):
         factory = APIRequestFactory()
         view = views.UserPerformanceViewSet.as_view({'get': 'list'}, pagination_class=None)
@@ -234,6 +261,12 @@ class TestViews(TestCase):
         self.assertEqual(expected, response.data)
         self.assertEqual(400, response.status_code)
 
+    def test_user_performance_view_set_list_nullable_sort(self):
+        # related fields can be null, which keyset cursors can't represent
+        for sort_by in ("code__updated_at", "code__quarantined_until"):
+            response = APIClient().get("/api/user_performances/", {'sort': sort_by, 'limit': 2})
+            self.assertEqual(400, response.status_code)
+
     def test_user_performance_view_set_list_no_content(self):
         factory = APIRequestFactory()
         view = views.UserPerformanceViewSet.as_view({'get': 'list'}, pagination_class=None)
@@ -247,6 +280,439 @@ class TestViews(TestCase):
         self.assertEqual(200, response.status_code)
 
 
+class TestReportMatch(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.codes = []
+        for i in range(3):
+            user = create_user(i + 1)
+            code = create_user_code(user)
+            models.UserPerformance.objects.create(user=user, code=code)
+            self.codes.append(code)
+        self.match = models.Match.objects.create(players=[code.pk for code in self.codes],
+                                                 allocated=timezone.now(),
+                                                 in_progress=True)
+
+    def test_report_records_participants(self):
+        winner = self.codes[1]
+        response = self.client.post(f"/api/matches/{self.match.pk}/report_match/",
+                                    {'outcome': 'ok', 'winners': [winner.pk], 'match_history': []},
+                                    format='json')
+        self.assertEqual(201, response.status_code)
+
+        match_result = models.MatchResult.objects.get()
+        participants = models.MatchParticipant.objects.filter(match_result=match_result)
+        self.assertEqual({code.pk for code in self.codes}, {p.code_id for p in participants})
+        for participant in participants:
+            performance = models.UserPerformance.objects.get(code_id=participant.code_id)
+            self.assertEqual(participant.code_id == winner.pk, participant.won)
+            self.assertEqual(participant.code.user_id, participant.user_id)
+            self.assertEqual(Decimal('25'), participant.mmr_before)
+            self.assertEqual(performance.mmr, participant.mmr_after)
+            self.assertEqual(performance.confidence, participant.confidence_after)
+        self.assertGreater(participants.get(code=winner).mmr_after, participants.exclude(code=winner)[0].mmr_after)
+
+    def test_report_series(self):
+        self.match.games = 3
+        self.match.save()
+        games = [{'winners': [self.codes[0].pk], 'match_history': [{'game': 0}]},
+                 {'winners': [self.codes[0].pk], 'match_history': [{'game': 1}]},
+                 {'winners': [self.codes[2].pk], 'match_history': [{'game': 2}]}]
+        response = self.client.post(f"/api/matches/{self.match.pk}/report_match/", {'outcome': 'ok', 'games': games},
+                                    format='json')
+        self.assertEqual(201, response.status_code)
+        self.assertFalse(models.Match.objects.exists())
+        self.assertFalse(models.UserCode.objects.filter(is_in_game=True).exists())
+
+        match_results = list(models.MatchResult.objects.order_by('pk'))
+        self.assertEqual([game['match_history'] for game in games], [result.match_events for result in match_results])
+        # each game is rated from the ratings left by the previous one
+        for previous, result in zip(match_results, match_results[1:]):
+            for code in self.codes:
+                self.assertEqual(models.MatchParticipant.objects.get(match_result=previous, code=code).mmr_after,
+                                 models.MatchParticipant.objects.get(match_result=result, code=code).mmr_before)
+        performance = models.UserPerformance.objects.get(code=self.codes[0])
+        self.assertEqual(3, performance.games_played)
+        self.assertEqual(models.MatchParticipant.objects.get(match_result=match_results[-1], code=self.codes[0])
+                         .mmr_after, performance.mmr)
+
+    def test_bad_series_reports(self):
+        self.match.games = 2
+        self.match.save()
+        game = {'winners': [self.codes[0].pk], 'match_history': []}
+        for games in ([], [game] * 3, [game, 'not a game'],
+                      [game, {'winners': [self.codes[-1].pk + 1], 'match_history': []}],
+                      [{'winners': [{'a': 1}], 'match_history': []}],
+                      [{'winners': [[self.codes[0].pk]], 'match_history': []}]):
+            with self.subTest(games=games):
+                response = self.client.post(f"/api/matches/{self.match.pk}/report_match/",
+                                            {'outcome': 'ok', 'games': games}, format='json')
+                self.assertEqual(400, response.status_code)
+        self.assertFalse(models.MatchResult.objects.exists())
+
+    def report_failure(self, causes):
+        return self.client.post(f"/api/matches/{self.match.pk}/report_match/", {'outcome': 'fail', 'causes': causes},
+                                format='json')
+
+    @mock.patch.dict(os.environ, {'QUARANTINE_BASE_SECONDS': '60'})
+    def test_failures_quarantine_with_backoff(self):
+        failing = self.codes[0]
+        response = self.report_failure({str(failing.pk): 'died', str(self.codes[1].pk): 'innocent'})
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(models.Match.objects.exists())
+        self.assertFalse(models.UserCode.objects.filter(is_in_game=True).exists())
+
+        failing.refresh_from_db()
+        self.assertEqual(1, failing.consecutive_failures)
+        first_period = failing.quarantined_until - timezone.now()
+        self.assertAlmostEqual(60, first_period.total_seconds(), delta=5)
+        self.assertFalse(models.UserCode.objects.filter(quarantined_until__isnull=False)
+                         .exclude(pk=failing.pk).exists())
+
+        self.match = models.Match.objects.create(players=[code.pk for code in self.codes], allocated=timezone.now(),
+                                                 in_progress=True)
+        self.report_failure({str(failing.pk): 'timeout'})
+        failing.refresh_from_db()
+        self.assertEqual(2, failing.consecutive_failures)
+        self.assertAlmostEqual(120, (failing.quarantined_until - timezone.now()).total_seconds(), delta=5)
+
+        response = self.client.get(f"/api/users/{failing.user_id}/user_code_list/")
+        self.assertEqual(2, response.data[0]['consecutive_failures'])
+        self.assertIsNotNone(response.data[0]['quarantined_until'])
+
+    def test_completed_match_resets_failures(self):
+        models.UserCode.objects.filter(pk=self.codes[0].pk).update(consecutive_failures=3)
+        self.client.post(f"/api/matches/{self.match.pk}/report_match/",
+                         {'outcome': 'ok', 'winners': [self.codes[0].pk], 'match_history': []}, format='json')
+        self.codes[0].refresh_from_db()
+        self.assertEqual(0, self.codes[0].consecutive_failures)
+
+    def test_bad_failure_reports(self):
+        self.assertEqual(400, self.report_failure(['died']).status_code)
+        self.assertEqual(400, self.report_failure({'not a code': 'died'}).status_code)
+        self.assertEqual(400, self.report_failure({str(self.codes[-1].pk + 1): 'died'}).status_code)
+        self.assertTrue(models.Match.objects.filter(pk=self.match.pk).exists())
+
+
+class TestDownload(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.code = create_user_code(create_user(1))
+        self.archive = b"tar content" * 100
+        self.code.archive_codec = "gzip"
+        self.code.source_code.save("blob.tar.gz", ContentFile(gzip.compress(self.archive)))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def test_download_compressed(self):
+        response = self.client.get(f"/api/code_list/{self.code.pk}/download/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual("gzip", response['Content-Encoding'])
+        self.assertIn("Accept-Encoding", response['Vary'])
+        self.assertTrue(response['Content-Disposition'].endswith("blob.tar"))
+        self.assertEqual(self.archive, gzip.decompress(b"".join(response.streaming_content)))
+
+    def test_download_presigned(self):
+        storage = SigningStorage(location=self.media_root.name)
+        with mock.patch.object(models.UserCode._meta.get_field('source_code'), 'storage', storage):
+            response = self.client.get(f"/api/code_list/{self.code.pk}/download/", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertEqual(302, response.status_code)
+            self.assertTrue(response['Location'].startswith(f"http://objects.test/{self.code.source_code.name}?"))
+            self.assertIn("ResponseContentEncoding=gzip", response['Location'])
+            self.assertFalse(response.has_header('Content-Encoding'))
+            self.assertIn('ETag', response)
+
+            # clients not accepting the stored encoding still get the archive decompressed by Django
+            response = self.client.get(f"/api/code_list/{self.code.pk}/download/")
+            self.assertEqual(200, response.status_code)
+            self.assertEqual(self.archive, b"".join(response.streaming_content))
+
+    def test_download_decompressed(self):
+        for accept_encoding in ("", "gzip;q=0, identity"):
+            with self.subTest(accept_encoding=accept_encoding):
+                response = self.client.get(f"/api/code_list/{self.code.pk}/download/",
+                                           HTTP_ACCEPT_ENCODING=accept_encoding)
+
+                self.assertEqual(200, response.status_code)
+                self.assertFalse(response.has_header('Content-Encoding'))
+                self.assertEqual(self.archive, b"".join(response.streaming_content))
+
+    def test_download_missing(self):
+        self.assertEqual(404, self.client.get(f"/api/code_list/{self.code.pk + 1}/download/").status_code)
+
+    def download(self, **headers):
+        return self.client.get(f"/api/code_list/{self.code.pk}/download/", HTTP_ACCEPT_ENCODING="gzip", **headers)
+
+    def test_download_revalidated(self):
+        self.code.content_hash = "ab" * 20
+        self.code.save()
+        etag = self.download()['ETag']
+        self.assertEqual(f'"{"ab" * 20}.gzip"', etag)
+        self.assertNotEqual(etag, self.client.get(f"/api/code_list/{self.code.pk}/download/")['ETag'])
+
+        response = self.download(HTTP_IF_NONE_MATCH=f'"other", {etag}')
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(etag, response['ETag'])
+        self.assertEqual(200, self.download(HTTP_IF_NONE_MATCH='"other"').status_code)
+
+    def test_download_range(self):
+        stored = gzip.compress(self.archive)
+        response = self.download(HTTP_RANGE="bytes=10-19")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(f"bytes 10-19/{len(stored)}", response['Content-Range'])
+        self.assertEqual(stored[10:20], b"".join(response.streaming_content))
+
+        response = self.download(HTTP_RANGE="bytes=-5")
+        self.assertEqual(stored[-5:], b"".join(response.streaming_content))
+
+        response = self.download(HTTP_RANGE=f"bytes={len(stored)}-")
+        self.assertEqual(416, response.status_code)
+        self.assertEqual(f"bytes */{len(stored)}", response['Content-Range'])
+
+        # the client's partial copy is of another version, send everything
+        response = self.download(HTTP_RANGE="bytes=10-19", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(stored, b"".join(response.streaming_content))
+
+    @mock.patch.dict(os.environ, {'CODE_DOWNLOAD_ACCEL_PREFIX': '/protected/'})
+    def test_download_offloaded(self):
+        response = self.download()
+        self.assertEqual(f"/protected/{self.code.source_code.name}", response['X-Accel-Redirect'])
+        self.assertEqual("gzip", response['Content-Encoding'])
+        self.assertIn('ETag', response)
+
+
+class TestMatchBundle(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root.name)
+        self.settings_override.enable()
+        self.client = APIClient()
+        self.codes = []
+        for i, content_hash in enumerate(["aa" * 20, "aa" * 20, "bb" * 20, "cc" * 20]):
+            code = create_user_code(create_user(i + 1))
+            code.content_hash, code.archive_codec = content_hash, "gzip"
+            code.source_code.save(f"{content_hash}.tar.gz", ContentFile(gzip.compress(content_hash.encode() * 1000)))
+            self.codes.append(code)
+        self.match = models.Match.objects.create(players=[code.pk for code in self.codes])
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.media_root.cleanup()
+
+    def get_bundle(self, **params):
+        response = self.client.get(f"/api/matches/{self.match.pk}/bundle/", params)
+        self.assertEqual(200, response.status_code)
+        with tarfile.open(fileobj=io.BytesIO(b"".join(response.streaming_content))) as bundle:
+            members = {member.name: bundle.extractfile(member).read() for member in bundle.getmembers()}
+        return json.loads(members.pop("manifest.json")), members
+
+    def test_bundle(self):
+        manifest, members = self.get_bundle()
+
+        self.assertEqual([code.pk for code in self.codes], [entry['code'] for entry in manifest])
+        self.assertEqual({f"{content_hash * 20}.tar.gz" for content_hash in ("aa", "bb", "cc")}, set(members))
+        for entry in manifest:
+            self.assertTrue(entry['included'])
+            self.assertEqual(entry['content_hash'].encode() * 1000, gzip.decompress(members[entry['entry']]))
+
+    def test_cached_entries_skipped(self):
+        manifest, members = self.get_bundle(cached=f"{'aa' * 20},{'cc' * 20}")
+
+        self.assertEqual([f"{'bb' * 20}.tar.gz"], list(members))
+        self.assertEqual([False, False, True, False], [entry['included'] for entry in manifest])
+        self.assertEqual(f"{'aa' * 20}.tar.gz", manifest[0]['entry'])
+
+    def test_missing_match(self):
+        self.assertEqual(410, self.client.get(f"/api/matches/{self.match.pk + 1}/bundle/").status_code)
+
+
+@mock.patch.dict(os.environ, {"PLAYER_DECISION_TIMEOUT": "5"})
+class TestMatchProvider(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.codes = []
+        for i in range(4):
+            code = create_user_code(create_user(i + 1))
+            code.content_hash = f"{i}" * 40
+            code.save()
+            self.codes.append(code)
+        self.matches = [models.Match.objects.create(players=[self.codes[0].pk, self.codes[1].pk]),
+                        models.Match.objects.create(players=[self.codes[2].pk, self.codes[3].pk]),
+                        models.Match.objects.create(players=[self.codes[1].pk, self.codes[2].pk])]
+
+    def test_random_match(self):
+        response = self.client.get("/api/request_match/")
+
+        self.assertEqual(200, response.status_code)
+        self.assertIn(response.json()['game_id'], [match.pk for match in self.matches])
+        self.assertEqual(1, models.Match.objects.filter(in_progress=True).count())
+
+    def test_prefers_cached_players(self):
+        for _ in range(5):
+            models.Match.objects.update(allocated=None, in_progress=False)
+            response = self.client.get("/api/request_match/", {'cached': f"{'2' * 40},{'3' * 8}"})
+            self.assertEqual(self.matches[1].pk, response.json()['game_id'])
+
+    def test_no_match(self):
+        models.Match.objects.update(in_progress=True)
+        self.assertEqual(204, self.client.get("/api/request_match/", {'cached': "0" * 40}).status_code)
+
+
+class TestCodeManifest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        start = timezone.datetime(2021, 8, 7, tzinfo=timezone.utc)
+        self.codes = []
+        for i in range(3):
+            code = create_user_code(create_user(i + 1))
+            code.source_code.name = f"blobs/{i}.tar.gz"
+            code.content_hash, code.archive_codec, code.archive_size = f"{i}" * 40, "gzip", 100 + i
+            code.updated_at = start + timezone.timedelta(hours=i)
+            code.save()
+            self.codes.append(code)
+        failed = create_user_code(create_user(4))
+        failed.source_code.name, failed.has_failed, failed.updated_at = "blobs/failed.tar.gz", True, start
+        failed.save()
+
+    def test_full_manifest(self):
+        response = self.client.get("/api/code_list/manifest/")
+
+        self.assertEqual(200, response.status_code)
+        manifest = response.json()
+        self.assertEqual([code.pk for code in self.codes], [entry['id'] for entry in manifest['codes']])
+        self.assertEqual({'id': self.codes[0].pk, 'commit_sha': self.codes[0].commit_sha, 'content_hash': "0" * 40,
+                          'codec': "gzip", 'size': 100, 'updated_at': self.codes[0].updated_at.isoformat()},
+                         manifest['codes'][0])
+        self.assertIn('next_since', manifest)
+
+    def test_since(self):
+        response = self.client.get("/api/code_list/manifest/", {'since': self.codes[0].updated_at.isoformat()})
+
+        self.assertEqual([code.pk for code in self.codes[1:]], [entry['id'] for entry in response.json()['codes']])
+
+    def test_not_modified(self):
+        etag = self.client.get("/api/code_list/manifest/")['ETag']
+        self.assertEqual(304, self.client.get("/api/code_list/manifest/", HTTP_IF_NONE_MATCH=etag).status_code)
+
+        self.codes[0].updated_at = timezone.now()
+        self.codes[0].save()
+        self.assertEqual(200, self.client.get("/api/code_list/manifest/", HTTP_IF_NONE_MATCH=etag).status_code)
+
+    def test_invalid_since(self):
+        self.assertEqual(400, self.client.get("/api/code_list/manifest/", {'since': "yesterday"}).status_code)
+
+
+class TestRatingHistory(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(1)
+        self.code = create_user_code(self.user)
+        start = timezone.datetime(2021, 8, 7, tzinfo=timezone.utc)
+        for i in range(50):
+            match_result = models.MatchResult.objects.create(players=[self.code.pk], winners=[], match_events=[],
+                                                             time_started=start,
+                                                             time_finished=start + timezone.timedelta(minutes=i))
+            models.MatchParticipant.objects.create(match_result=match_result, code=self.code, user=self.user,
+                                                   mmr_after=25 + i % 5, confidence_after=8 - i / 10)
+
+    def test_full_history(self):
+        response = self.client.get(f"/api/code_list/{self.code.pk}/rating_history/", {'points': 100})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(50, response.data['total_points'])
+        self.assertEqual(50, len(response.data['points']))
+        self.assertEqual({'match_id': models.MatchResult.objects.first().pk,
+                          'time': timezone.datetime(2021, 8, 7, tzinfo=timezone.utc),
+                          'mu': 25.0,
+                          'sigma': 8.0}, response.data['points'][0])
+
+    def test_downsampled_history(self):
+        response = self.client.get(f"/api/code_list/{self.code.pk}/rating_history/", {'points': 10})
+
+        points = response.data['points']
+        self.assertEqual(10, len(points))
+        self.assertEqual(models.MatchResult.objects.last().pk, points[-1]['match_id'])
+        self.assertEqual(sorted(points, key=lambda p: p['time']), points)
+
+    def test_bad_requests(self):
+        response = self.client.get(f"/api/code_list/{self.code.pk}/rating_history/", {'points': 1})
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get(f"/api/code_list/{self.code.pk + 1}/rating_history/")
+        self.assertEqual(404, response.status_code)
+
+
+class TestRankView(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.performances = []
+        for i in range(10):
+            user = create_user(i + 1)
+            self.performances.append(models.UserPerformance.objects.create(user=user,
+                                                                           mmr=20 + i,
+                                                                           code=create_user_code(user)))
+        self.performances.reverse()  # leaderboard order, highest mmr first
+
+    def test_rank_by_code(self):
+        target = self.performances[3]
+        response = self.client.get("/api/user_performances/rank/", {'code': target.code.pk, 'neighbours': 2})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(4, response.data['rank'])
+        self.assertEqual(10, response.data['total'])
+        self.assertEqual(60, response.data['percentile'])
+        self.assertEqual(target.pk, response.data['performance']['pk'])
+        self.assertEqual([p.pk for p in self.performances[1:3]], [p['pk'] for p in response.data['above']])
+        self.assertEqual([p.pk for p in self.performances[4:6]], [p['pk'] for p in response.data['below']])
+
+    def test_rank_by_user(self):
+        target = self.performances[0]
+        response = self.client.get("/api/user_performances/rank/", {'user': target.user.pk})
+
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.data['rank'])
+        self.assertEqual([], response.data['above'])
+        self.assertEqual([p.pk for p in self.performances[1:6]], [p['pk'] for p in response.data['below']])
+
+    def test_rank_ties(self):
+        models.UserPerformance.objects.update(mmr=25)
+        oldest = models.UserPerformance.objects.order_by('pk').first()
+        response = self.client.get("/api/user_performances/rank/", {'code': oldest.code.pk})
+        self.assertEqual(10, response.data['rank'])
+
+    def test_rank_non_primary_excluded(self):
+        code = self.performances[0].code
+        code.primary = False
+        code.save()
+
+        response = self.client.get("/api/user_performances/rank/", {'code': code.pk})
+        self.assertEqual(404, response.status_code)
+
+        response = self.client.get("/api/user_performances/rank/", {'code': code.pk, 'non_primary': 'true'})
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, response.data['rank'])
+
+    def test_rank_bad_request(self):
+        response = self.client.get("/api/user_performances/rank/")
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get("/api/user_performances/rank/", {'code': 'abc'})
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get("/api/user_performances/rank/", {'code': 1, 'neighbours': 'lots'})
+        self.assertEqual(400, response.status_code)
+
+        response = self.client.get("/api/user_performances/rank/", {'code': 1, 'neighbours': -2})
+        self.assertEqual(400, response.status_code)
+
+
 class TestSettingsView(TestCase):
     def setUp(self) -> None:
         self.user = create_user(user_id=1, name="First Last")
@@ -397,6 +863,22 @@ class TestSettingsView(TestCase):
         self.assertEqual(True, self.user_codes[0].primary)
         self.assertEqual(True, self.user_codes[0].to_clone)
 
+    def test_enable_codes_archives_lazily(self):
+        factory = APIRequestFactory()
+        view = views.SettingsViewSet.as_view({'post': 'enabled_codes'})
+
+        self.user_codes[2].source_code = "already_archived.tar"
+        self.user_codes[2].save()
+
+        request = factory.post('/', {'enabled_codes': [self.user_codes[2].pk, self.user_codes[3].pk]}, format="json")
+        request.session = {'github_username': self.user.github_username}
+        with mock.patch('game_engine.views.archive_enabled_code') as archive_mock, \
+                self.captureOnCommitCallbacks(execute=True):
+            response = view(request)
+
+        self.assertEqual(200, response.status_code)
+        archive_mock.delay.assert_called_once_with(self.user_codes[3].pk)
+
     def test_enable_codes_not_list(self):
         factory = APIRequestFactory()
 
@@ -451,3 +933,56 @@ class TestSettingsView(TestCase):
         response = view(request)
         self.assertEqual(200, response.status_code)
         self.assertEqual(expected, response.data)
+
+
+class TestQueryCounts(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+
+    @staticmethod
+    def create_rows(count):
+        for _ in range(count):
+            user = create_user(models.User.objects.count() + 1)
+            user_code = create_user_code(user)
+            models.UserPerformance.objects.create(user=user, code=user_code)
+            create_match_result_entry(user)
+
+    def assert_constant_queries(self, url, expected_queries):
+        self.create_rows(2)
+        with self.assertNumQueries(expected_queries):
+            self.client.get(url)
+        self.create_rows(20)
+        with self.assertNumQueries(expected_queries):
+            response = self.client.get(url)
+        self.assertEqual(200, response.status_code)
+
+    def test_leaderboard_queries(self):
+        self.assert_constant_queries("/api/user_performances/", 1)
+
+    def test_match_history_queries(self):
+        self.assert_constant_queries("/api/match_history/", 1)
+
+    def test_user_code_list_queries(self):
+        user = create_user(1000)
+        for _ in range(3):
+            create_user_code(user)
+        with self.assertNumQueries(2):  # EXISTS + list
+            response = self.client.get(f"/api/users/{user.pk}/user_code_list/")
+        self.assertEqual(f"http://testserver/api/users/{user.pk}/", response.json()[-1]['user'])
+
+    def test_performance_list_queries(self):
+        user = create_user(1000)
+        for _ in range(3):
+            models.UserPerformance.objects.create(user=user, code=create_user_code(user))
+        with self.assertNumQueries(2):  # EXISTS + list
+            self.client.get(f"/api/users/{user.pk}/performance_list/")
+
+    def test_urls_reversed_once(self):
+        self.create_rows(10)
+        with mock.patch('rest_framework.relations.reverse', wraps=relations.reverse) as reverse_mock:
+            response = self.client.get("/api/user_performances/")
+        self.assertEqual(10, len(response.json()['results']))
+        self.assertEqual(2, reverse_mock.call_count)  # `url` and `user`
+        last = models.UserPerformance.objects.order_by('pk').first()  # equal ratings, newest first
+        self.assertEqual(f"http://testserver/api/users/{last.user.pk}/", response.json()['results'][-1]['user'])
+        self.assertEqual(f"http://testserver/api/user_performances/{last.pk}/", response.json()['results'][-1]['url'])
@@ -1,3 +1,5 @@
+import os
+from datetime import timedelta
 from enum import Enum
 
 
@@ -6,3 +8,48 @@ class Leagues(Enum):
     DIV_2 = 1 << 1
     DIV_3 = 1 << 2
     DIV_4 = 1 << 3
+
+
+def downsample_lttb(points, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling: picks `threshold` points that keep the visual shape of the series.
+
+    :param points: sequence of tuples ordered by x, the first two items of each being (x, y)
+    :param threshold: number of points to keep
+    :return: list of the selected tuples, always including the first and last points
+    """
+    if threshold >= len(points):
+        return list(points)
+    if threshold < 3:
+        return [points[0], points[-1]][:max(threshold, 0)]
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    previous = points[0]
+    for bucket in range(threshold - 2):
+        start = int(bucket * bucket_size) + 1
+        end = int((bucket + 1) * bucket_size) + 1
+
+        # average of the next bucket is the third vertex of the triangle
+        next_bucket = points[end:min(int((bucket + 2) * bucket_size) + 1, len(points))] or [points[-1]]
+        average_x = sum(p[0] for p in next_bucket) / len(next_bucket)
+        average_y = sum(p[1] for p in next_bucket) / len(next_bucket)
+
+        def triangle_area(p):
+            return abs((previous[0] - average_x) * (p[1] - previous[1]) -
+                       (previous[0] - p[0]) * (average_y - previous[1]))
+
+        previous = max(points[start:end], key=triangle_area)
+        sampled.append(previous)
+    sampled.append(points[-1])
+    return sampled
+
+
+def quarantine_period(consecutive_failures: int) -> timedelta:
+    """
+    :return: how long a code is kept out of matchmaking after its `consecutive_failures`-th failure in a row,
+        QUARANTINE_BASE_SECONDS (60) doubled with every failure, up to QUARANTINE_MAX_SECONDS (one day)
+    """
+    base = float(os.environ.get("QUARANTINE_BASE_SECONDS", 60))
+    maximum = float(os.environ.get("QUARANTINE_MAX_SECONDS", 24 * 60 * 60))
+    return timedelta(seconds=min(base * 2 ** min(max(consecutive_failures - 1, 0), 32), maximum))
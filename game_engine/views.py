@@ -1,8 +1,15 @@
+from datetime import timedelta
 from distutils.util import strtobool
-
-from django.core.exceptions import FieldError
-from django.http import HttpResponse, JsonResponse
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from rest_framework import viewsets
 # from rest_framework import authentication
@@ -12,14 +19,22 @@ from rest_framework.response import Response
 from rest_framework.decorators import action
 from rest_framework.routers import APIRootView
 
-from game_engine.models import Match, User, UserCode, MatchResult, UserPerformance, UserSettings
+from code_manager.compression import decompress_chunks, get_content_encoding, get_extension
+from code_manager.storage import presigned_url
+from code_manager.tasks import archive_enabled_code
+from game_engine.pagination import KeysetPagination
+from game_engine.models import Match, User, UserCode, MatchResult, UserPerformance, UserSettings, MatchParticipant
+from game_engine.utils import downsample_lttb, quarantine_period
 from game_engine.perms import UserLoggedIn, UserLoggedInAndOwnsCode
 from game_engine.serializers import UserSerializer, MatchSerializer, UserCodeSerializer, UserPerformanceSerializer, \
     UserSettingsSerializer
 from game_engine.serializers import MatchResultSerializer
 
+import hashlib
+import json
 import random
 import os
+import tarfile
 from trueskill import Rating, rate
 
 
@@ -30,23 +45,26 @@ class UserViewSet(viewsets.ModelViewSet):
     @action(detail=True)
     def user_code_list(self, request, pk=None):
         objects = UserCode.objects.filter(user_id=pk)
-        if objects.count() == 0:
+        if not objects.exists():
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         serializer = UserCodeSerializer(objects, many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(detail=True)
     def performance_list(self, request, pk=None):
-        objects = UserPerformance.objects.filter(user_id=pk, code__primary=True)
-        if objects.count() == 0:
+        objects = UserPerformance.objects.filter(user_id=pk, code__primary=True).select_related('user')
+        if not objects.exists():
             return Response(None, status=status.HTTP_204_NO_CONTENT)
         serializer = UserPerformanceSerializer(objects, many=True, context={'request': request})
         return Response(serializer.data)
 
-    @action(detail=True)
+    @action(detail=True, pagination_class=KeysetPagination)
     def user_match_list(self, request, pk=None):
-        objects = MatchResult.objects.filter(players__contains=pk).order_by('-time_finished')
-        if objects.count() == 0:
+        try:
+            objects = MatchResult.objects.filter(participants__user_id=pk).distinct().order_by('-time_finished', '-pk')
+        except ValueError:
+            return Response({"ok": False, "message": "User ID not an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if not objects.exists():
             return Response(None, status=status.HTTP_204_NO_CONTENT)
 
         page = self.paginate_queryset(objects)
@@ -66,41 +84,107 @@ class MatchViewSet(viewsets.ModelViewSet):
 
     @staticmethod
     def handle_ok_match(request, match):
-        if not isinstance(request.data.get("winners", None), list):
-            return Response({"ok": False, "message": "No winners provided"}, status=status.HTTP_400_BAD_REQUEST)
+        """
+        Records the games of a match. A series is reported in one batch as `games`, a list of
+        {"winners": [...], "match_history": [...]} in the order they were played, which may be cut short of
+        `match.games`; a single game can also be reported with `winners` and `match_history` directly. Ratings are
+        updated game after game, so each game is rated from the ratings the previous one left.
+        """
+        games = request.data.get("games", None)
+        if games is None:
+            games = [{"winners": request.data.get("winners", None),
+                      "match_history": request.data.get("match_history", None)}]
+        if not isinstance(games, list) or not 0 < len(games) <= match.games:
+            return Response({"ok": False, "message": f"Expected between 1 and {match.games} game(s)"},
+                            status=status.HTTP_400_BAD_REQUEST)
 
-        match_players = match.players
-        winners = request.data["winners"]
+        for game in games:
+            if not isinstance(game, dict) or not isinstance(game.get("winners", None), list):
+                return Response({"ok": False, "message": "No winners provided"}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not set(winners).issubset(set(match_players)):
-            return Response({"ok": False, "message": "One or more winner not part of match"},
-                            status=status.HTTP_400_BAD_REQUEST)
+            if not all(isinstance(winner, int) and not isinstance(winner, bool) for winner in game["winners"]):
+                return Response({"ok": False, "message": "Winners must be player code IDs"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            if not set(game["winners"]).issubset(set(match.players)):
+                return Response({"ok": False, "message": "One or more winner not part of match"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+            if not isinstance(game.get("match_history", None), list):
+                return Response({"ok": False, "message": "Missing match history"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            for game in games:
+                MatchViewSet.record_game(match, game["winners"], game["match_history"])
+            match.delete()
+
+            # a completed match ends any run of failures
+            UserCode.objects.filter(pk__in=match.players).update(is_in_game=False, consecutive_failures=0)
+        return Response(status=status.HTTP_201_CREATED)
 
-        if not isinstance(request.data.get("match_history", None), list):
-            return Response({"ok": False, "message": "Missing match history"}, status=status.HTTP_400_BAD_REQUEST)
+    @staticmethod
+    def record_game(match, winners, match_history):
+        match_players = match.players
 
         match_result = MatchResult()
         match_result.time_started = match.allocated
-        match_result.players = match.players
-        match_result.winners = request.data["winners"]
-        match_result.match_events = request.data["match_history"]
+        match_result.players = match_players
+        match_result.winners = winners
+        match_result.match_events = match_history
         match_result.save()
 
-        match.delete()
-
         ranks, rating_group = MatchViewSet.prep_for_rating(match_players, winners)
 
         new_ratings = rate(rating_group, ranks)  # generate new MMRs based on TrueSkill
 
-        for player in match_players:  # update every player with their new MMRs
+        participants = []
+        for player, old_rating, new_rating in zip(match_players, rating_group, new_ratings):
             up_instance = UserPerformance.objects.get(code__pk=player)
-            player_rating = new_ratings.pop(0)[0]  # needs two layers to index -> team -> player
+            player_rating = new_rating[0]  # needs two layers to index -> team -> player
             up_instance.mmr = player_rating.mu
             up_instance.confidence = player_rating.sigma
             up_instance.save()
 
-        UserCode.objects.filter(pk__in=match_players).update(is_in_game=False)
-        return Response(status=status.HTTP_201_CREATED)
+            participants.append(MatchParticipant(match_result=match_result,
+                                                 code_id=player,
+                                                 user_id=up_instance.user_id,
+                                                 won=player in winners,
+                                                 mmr_before=old_rating[0].mu,
+                                                 confidence_before=old_rating[0].sigma,
+                                                 mmr_after=player_rating.mu,
+                                                 confidence_after=player_rating.sigma))
+        MatchParticipant.objects.bulk_create(participants)
+
+    @staticmethod
+    def handle_failed_match(request, match):
+        """
+        Drops a match that couldn't be played. Codes blamed for it (`causes`: code ID -> "timeout" or "died") are
+        quarantined, for a period doubling with each failure in a row, see `quarantine_period`.
+        """
+        causes = request.data.get("causes", None)
+        if not isinstance(causes, dict):
+            return Response({"ok": False, "message": "Missing failure causes"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            causes = {int(player_code): cause for player_code, cause in causes.items()}
+        except (TypeError, ValueError):
+            return Response({"ok": False, "message": "Invalid player code in failure causes"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not set(causes).issubset(set(match.players)):
+            return Response({"ok": False, "message": "One or more failed player not part of match"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        now = timezone.now()
+        failed_codes = [player_code for player_code, cause in causes.items() if cause in ["timeout", "died"]]
+        with transaction.atomic():
+            for code in UserCode.objects.select_for_update().filter(pk__in=failed_codes):
+                code.consecutive_failures += 1
+                code.quarantined_until = now + quarantine_period(code.consecutive_failures)
+                code.save(update_fields=['consecutive_failures', 'quarantined_until'])
+                print(f"quarantined code {code.pk} until {code.quarantined_until} ({causes[code.pk]})")
+            UserCode.objects.filter(pk__in=match.players).update(is_in_game=False)
+            match.delete()
+        return Response({"ok": True, "message": f"{len(failed_codes)} code(s) quarantined"})
 
     @staticmethod
     def prep_for_rating(match_players, winners):
@@ -124,6 +208,72 @@ class MatchViewSet(viewsets.ModelViewSet):
                 ranks.append(1)
         return ranks, rating_group
 
+    @staticmethod
+    def bundle_entries(codes, cached_hashes):
+        """
+        :return: 2-tuple: (manifest: one dict per code, {entry name: UserCode} of the archives to send). Codes with the
+            same content share an entry, content the runner already has (`cached_hashes`) isn't sent.
+        """
+        manifest, entries = [], {}
+        for code in codes:
+            entry = None
+            if code.source_code:
+                entry = f"{code.content_hash or f'code-{code.pk}'}.{get_extension(code.archive_codec)}"
+                if not code.content_hash or code.content_hash not in cached_hashes:
+                    entries.setdefault(entry, code)
+            manifest.append({'code': code.pk,
+                             'content_hash': code.content_hash,
+                             'commit_sha': code.commit_sha,
+                             'codec': code.archive_codec,
+                             'entry': entry,
+                             'included': entry in entries})
+        return manifest, entries
+
+    @staticmethod
+    def tar_member(name, size):
+        tar_info = tarfile.TarInfo(name)
+        tar_info.size, tar_info.mtime, tar_info.mode = size, int(timezone.now().timestamp()), 0o644
+        return tar_info.tobuf(format=tarfile.GNU_FORMAT)
+
+    @staticmethod
+    def stream_bundle(manifest, entries, chunk_size=64 * 1024):
+        """
+        Yields an uncompressed tar of manifest.json followed by the entries, archives are read chunk by chunk and
+        never held in memory whole.
+        """
+        manifest_json = json.dumps(manifest).encode()
+        yield MatchViewSet.tar_member("manifest.json", len(manifest_json))
+        yield manifest_json + tarfile.NUL * (-len(manifest_json) % tarfile.BLOCKSIZE)
+
+        for name, code in entries.items():
+            with code.source_code.open('rb') as archive:
+                size = code.source_code.size
+                yield MatchViewSet.tar_member(name, size)
+                while chunk := archive.read(chunk_size):
+                    yield chunk
+            yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+        yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)  # end of archive
+
+    # noinspection PyUnusedLocal
+    @action(detail=True, permission_classes=[])
+    def bundle(self, request, pk=None):
+        """
+        Every code of the match in a single streamed tar: manifest.json, listing each player's code with its content
+        hash and bundle entry, then one stored archive per distinct content. Content hashes the runner already has
+        cached can be passed as `?cached=<hash>,<hash>`, those archives are left out.
+        """
+        match = Match.objects.filter(pk=pk).first()
+        if match is None:
+            return Response({"ok": False, "message": "Match has been timed out"}, status=status.HTTP_410_GONE)
+
+        codes = UserCode.objects.in_bulk(match.players)
+        cached_hashes = set(filter(None, request.query_params.get("cached", "").split(",")))
+        manifest, entries = self.bundle_entries([codes[player] for player in match.players if player in codes],
+                                                cached_hashes)
+        resp = StreamingHttpResponse(self.stream_bundle(manifest, entries), content_type="application/x-tar")
+        resp['Content-Disposition'] = f'attachment; filename=match-{match.pk}.tar'
+        return resp
+
     # noinspection PyUnusedLocal,PyShadowingBuiltins
     @action(methods=["POST"], detail=True, permission_classes=[])
     def report_match(self, request, pk=None, format=None):
@@ -137,19 +287,39 @@ class MatchViewSet(viewsets.ModelViewSet):
         if request.data["outcome"] == "ok":
             return self.handle_ok_match(request=request, match=match)
         if request.data["outcome"] == "fail":
-            if not isinstance(request.data.get("causes", None), list):
-                return Response({"ok": False, "message": "Missing failure causes"})
-            for player_code, cause in request.data["causes"].items():
-                print(player_code, cause)
-                if cause in ["timeout", "died"]:
-                    pass  # todo: do something if a player times out
+            return self.handle_failed_match(request=request, match=match)
+        return Response({"ok": False, "message": "Unknown outcome"}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class MatchProvider(viewsets.ViewSet):
+    @staticmethod
+    def cached_players(matches, cached_hashes):
+        """
+        :param cached_hashes: content hashes of the archives a runner has cached, or prefixes of them (e.g. 8 hex
+            characters each): a false positive only costs a download, so runners can keep the list short
+        :return: dict: match -> number of its players whose code the runner has cached
+        """
+        prefix_lengths = {len(cached_hash) for cached_hash in cached_hashes}
+        code_hashes = dict(UserCode.objects.filter(pk__in={player for match in matches for player in match.players})
+                           .exclude(content_hash='').values_list('pk', 'content_hash'))
+        cached_codes = {code for code, content_hash in code_hashes.items()
+                        if any(content_hash[:length] in cached_hashes for length in prefix_lengths)}
+        return {match: sum(player in cached_codes for player in match.players) for match in matches}
+
     @staticmethod
     def list(request):
-        available_matches = Match.objects.filter(allocated__isnull=True, in_progress=False, over=False)
-        if available_matches.count() > 0:
+        """
+        Allocates a random available match. Runners can pass the content hashes of the code they have cached as
+        `?cached=<hash>,<hash>`, matches with the most players already cached are then handed out first, saving
+        the runner downloads and container warm-ups.
+        """
+        available_matches = list(Match.objects.filter(allocated__isnull=True, in_progress=False, over=False))
+        if len(available_matches) > 0:
+            cached_hashes = set(filter(None, request.query_params.get("cached", "").split(",")))
+            if cached_hashes:
+                scores = MatchProvider.cached_players(available_matches, cached_hashes)
+                best_score = max(scores.values())
+                available_matches = [match for match, score in scores.items() if score == best_score]
             match = random.choice(available_matches)
             match.allocated = timezone.now()  # prevents another request from getting the same match
             match.in_progress = True
@@ -163,40 +333,212 @@ class UserCodeViewSet(viewsets.ModelViewSet):
     queryset = UserCode.objects.all()
     serializer_class = UserCodeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    default_history_points = 200
+    max_history_points = 1000
+    # archives stored while a manifest was being built may carry an earlier `updated_at`, next syncs look back this far
+    manifest_overlap = timedelta(seconds=float(os.environ.get("MANIFEST_SYNC_OVERLAP_SECONDS", 60)))
+
+    @action(detail=False, permission_classes=[])
+    def manifest(self, request):
+        """
+        Every schedulable code with what identifies its archive, for runners keeping a local cache. `?since=` (the
+        `next_since` of the previous manifest) only lists codes whose archive changed since, and the ETag lets an
+        unchanged manifest be revalidated for free.
+        """
+        codes = UserCode.objects.filter(Q(to_clone=True) | Q(primary=True), has_failed=False).exclude(source_code='')
+        if (since := request.query_params.get("since")) is not None:
+            try:
+                since = parse_datetime(since)
+            except ValueError:
+                since = None
+            if since is None:
+                return Response({"ok": False, "message": "since is not an ISO 8601 datetime"},
+                                status=status.HTTP_400_BAD_REQUEST)
+            codes = codes.filter(updated_at__gt=since)
+
+        fields = ('pk', 'commit_sha', 'content_hash', 'archive_codec', 'archive_size', 'updated_at')
+        manifest = [{'id': code['pk'],
+                     'commit_sha': code['commit_sha'],
+                     'content_hash': code['content_hash'],
+                     'codec': code['archive_codec'],
+                     'size': code['archive_size'],
+                     'updated_at': code['updated_at'] and code['updated_at'].isoformat()}
+                    for code in codes.order_by('updated_at', 'pk').values(*fields)]
+        # next_since moves with the clock, the ETag only covers the listed codes
+        etag = f'"{hashlib.sha1(json.dumps(manifest).encode()).hexdigest()}"'
+        if self.etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag):
+            resp = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            next_since = timezone.now() - self.manifest_overlap
+            resp = JsonResponse({'next_since': next_since.isoformat(), 'codes': manifest})
+        resp['ETag'] = etag
+        resp['Cache-Control'] = 'no-cache'
+        return resp
+
+    @staticmethod
+    def accepts_encoding(request, encoding):
+        for accepted in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+            coding, _, params = accepted.strip().partition(';')
+            if coding.strip().lower() in (encoding, '*'):
+                return params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000')
+        return False
+
+    @staticmethod
+    def etag_matches(header, etag):
+        return header.strip() == '*' or etag in (candidate.strip() for candidate in header.split(','))
+
+    @staticmethod
+    def parse_range(header, size):
+        """
+        :return: (first byte, last byte) of a single `bytes=` range, None if the header should be ignored (it isn't a
+            single byte range), (None, None) if the range can't be satisfied
+        """
+        unit, _, ranges = header.partition('=')
+        if unit.strip() != 'bytes' or ',' in ranges:
+            return None
+        first, _, last = ranges.strip().partition('-')
+        try:
+            if not first:  # suffix range, the last `last` bytes
+                first, last = max(size - int(last), 0), size - 1
+            else:
+                first, last = int(first), min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+        if first > last or first >= size:
+            return None, None
+        return first, last
+
+    @staticmethod
+    def read_range(file, first, last, chunk_size=64 * 1024):
+        with file:
+            file.seek(first)
+            remaining = last - first + 1
+            while remaining > 0 and (chunk := file.read(min(chunk_size, remaining))):
+                remaining -= len(chunk)
+                yield chunk
 
     @action(detail=True, permission_classes=[])
     def download(self, request, pk=None):
+        """
+        Tar archive of the code. Compressed archives are sent as stored, with a Content-Encoding, to clients accepting
+        that encoding (runners using requests/urllib3 decode it transparently), and decompressed on the fly otherwise.
+
+        Responses are streamed and carry a strong ETag derived from the archived content, so runners can keep a copy
+        and revalidate it with If-None-Match. Stored archives also support single byte ranges, and can be offloaded to
+        the web server with X-Accel-Redirect by setting CODE_DOWNLOAD_ACCEL_PREFIX. With an object storage able to sign
+        URLs (see code_manager/storage.py), runners are redirected to a short-lived presigned URL instead.
+        """
         user_code = UserCode.objects.filter(pk=pk).first()
-        if user_code is not None:
-            resp = HttpResponse(user_code.source_code.file, content_type="application/octet-stream")
-            resp['Content-Disposition'] = f'attachment; filename={os.path.basename(user_code.source_code.name)}'
-            return resp
-        return Response(status=status.HTTP_404_NOT_FOUND)  # this should not happen to the game runner (matchmaking)
+        if user_code is None or not user_code.source_code:
+            return Response(status=status.HTTP_404_NOT_FOUND)  # this should not happen to the game runner
+
+        encoding = get_content_encoding(user_code.archive_codec)
+        stored = encoding is None or self.accepts_encoding(request, encoding)
+        # one ETag per representation, a decompressed archive isn't byte for byte the stored one
+        etag = f'"{user_code.content_hash or user_code.commit_sha}{f".{encoding}" if stored and encoding else ""}"'
+
+        # the content coding is undone by the client, so the file is always a plain tar
+        filename = os.path.basename(user_code.source_code.name)
+        extension = get_extension(user_code.archive_codec)
+        if filename.endswith(extension):
+            filename = f"{filename[:-len(extension)]}tar"
+
+        if self.etag_matches(request.META.get('HTTP_IF_NONE_MATCH', ''), etag):
+            resp = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        elif not stored:
+            resp = StreamingHttpResponse(decompress_chunks(user_code.source_code.open('rb'), user_code.archive_codec),
+                                         content_type="application/octet-stream")
+        elif url := presigned_url(user_code.source_code.storage, user_code.source_code.name,
+                                  settings.CODE_DOWNLOAD_URL_EXPIRY, filename, encoding):
+            resp = HttpResponseRedirect(url)
+        elif accel_prefix := os.environ.get("CODE_DOWNLOAD_ACCEL_PREFIX"):
+            resp = HttpResponse(content_type="application/octet-stream")
+            resp['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{user_code.source_code.name}"
+        else:
+            size = user_code.source_code.size
+            byte_range = None
+            if 'HTTP_RANGE' in request.META and request.META.get('HTTP_IF_RANGE', etag) == etag:
+                byte_range = self.parse_range(request.META['HTTP_RANGE'], size)
+
+            if byte_range is None:
+                resp = FileResponse(user_code.source_code.open('rb'), content_type="application/octet-stream")
+            elif byte_range == (None, None):
+                resp = HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+                resp['Content-Range'] = f"bytes */{size}"
+            else:
+                first, last = byte_range
+                resp = StreamingHttpResponse(self.read_range(user_code.source_code.open('rb'), first, last),
+                                             status=status.HTTP_206_PARTIAL_CONTENT,
+                                             content_type="application/octet-stream")
+                resp['Content-Range'] = f"bytes {first}-{last}/{size}"
+                resp['Content-Length'] = str(last - first + 1)
+            resp['Accept-Ranges'] = 'bytes'
+
+        resp['ETag'] = etag
+        resp['Last-Modified'] = http_date(user_code.commit_time.timestamp())
+        resp['Cache-Control'] = 'no-cache'  # keep a copy, but revalidate it: the code may get a new commit
+        if stored and encoding is not None and status.is_success(resp.status_code):
+            resp['Content-Encoding'] = encoding
+        patch_vary_headers(resp, ('Accept-Encoding',))
+        resp['Content-Disposition'] = f'attachment; filename={filename}'
+        return resp
+
+    @action(detail=True, permission_classes=[])
+    def rating_history(self, request, pk=None):
+        """
+        Rating after every rated match of this code, oldest first, downsampled to at most `?points=` entries
+        (default 200) so charts of codes with long histories stay light.
+        """
+        try:
+            max_points = min(int(request.query_params.get("points", self.default_history_points)),
+                             self.max_history_points)
+        except ValueError:
+            return Response({"ok": False, "message": "points not an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if max_points < 2:
+            return Response({"ok": False, "message": "points must be at least 2"}, status=status.HTTP_400_BAD_REQUEST)
+        if not UserCode.objects.filter(pk=pk).exists():
+            return Response(status=status.HTTP_404_NOT_FOUND)
+
+        # MatchParticipant rows are appended on every rating update and indexed by code
+        history = MatchParticipant.objects.filter(code_id=pk, mmr_after__isnull=False) \
+            .order_by('match_result__time_finished', 'match_result_id') \
+            .values_list('match_result__time_finished', 'mmr_after', 'confidence_after', 'match_result_id')
+        points = [(time_finished.timestamp(), float(mu), float(sigma), time_finished, match_id)
+                  for time_finished, mu, sigma, match_id in history]
+
+        return Response({'code': int(pk),
+                         'total_points': len(points),
+                         'points': [{'match_id': match_id, 'time': time_finished, 'mu': mu, 'sigma': sigma}
+                                    for _, mu, sigma, time_finished, match_id in downsample_lttb(points, max_points)]})
 
 
 class UserPerformanceViewSet(viewsets.ModelViewSet):
-    queryset = UserPerformance.objects.all()
+    queryset = UserPerformance.objects.select_related('user')
     serializer_class = UserPerformanceSerializer
+    pagination_class = KeysetPagination
+    max_neighbours = 50
+    sort_fields = ('mmr', 'confidence', 'games_played', 'league', 'pk')
+
+    @staticmethod
+    def include_non_primary(request):
+        include_non_primary = request.query_params.get("non_primary", "false")
+        try:
+            return strtobool(include_non_primary)
+        except ValueError:
+            return False
 
     def list(self, request, **kwargs):
         sort_by = request.query_params.get("sort", "mmr")
+        if sort_by not in self.sort_fields:  # keyset pagination needs non-null sort keys
+            return Response({"ok": False, "message": f"Unknown sort field '{sort_by}'"},
+                            status=status.HTTP_400_BAD_REQUEST)
         sort_order = "-"
         if request.query_params.get("order", "desc") == "asc":
             sort_order = ""
         qs = f"{sort_order}{sort_by}"
 
-        include_non_primary = request.query_params.get("non_primary", "false")
-        try:
-            include_non_primary = strtobool(include_non_primary)
-        except ValueError:
-            include_non_primary = False
-
-        try:
-            objects = UserPerformance.objects.all().order_by(qs) if include_non_primary \
-                else UserPerformance.objects.filter(code__primary=True).order_by(qs)
-        except FieldError:
-            return Response({"ok": False, "message": f"Unknown sort field '{sort_by}'"},
-                            status=status.HTTP_400_BAD_REQUEST)
+        objects = self.queryset.order_by(qs) if self.include_non_primary(request) \
+            else self.queryset.filter(code__primary=True).order_by(qs)
 
         page = self.paginate_queryset(objects)
         if page is not None:
@@ -205,9 +547,66 @@ class UserPerformanceViewSet(viewsets.ModelViewSet):
         serializer = UserPerformanceSerializer(objects, many=True, context={'request': request})
         return Response(serializer.data)
 
+    @staticmethod
+    def ranked_above(performance):
+        # leaderboard order is (-mmr, -pk) like its paginated list, ties go to the newer performance
+        return Q(mmr__gt=performance.mmr) | Q(mmr=performance.mmr, pk__gt=performance.pk)
+
+    @staticmethod
+    def ranked_below(performance):
+        return Q(mmr__lt=performance.mmr) | Q(mmr=performance.mmr, pk__lt=performance.pk)
+
+    @action(detail=False)
+    def rank(self, request):
+        """
+        Looks up the leaderboard position of a code (`?code=<id>`) or of a user's best code (`?user=<id>`).
+
+        The neighbours are short range reads on the (mmr, id) index, but the rank counts every index entry above the
+        code, so it costs O(rank), and the total counts all ranked codes. `percentile` is the percentage of ranked
+        codes placed below the requested one.
+        """
+        try:
+            neighbours = min(int(request.query_params.get("neighbours", 5)), self.max_neighbours)
+        except ValueError:
+            return Response({"ok": False, "message": "neighbours not an integer"}, status=status.HTTP_400_BAD_REQUEST)
+        if neighbours < 0:
+            return Response({"ok": False, "message": "neighbours must not be negative"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        objects = self.queryset.all() if self.include_non_primary(request) \
+            else self.queryset.filter(code__primary=True)
+
+        try:
+            if (code_id := request.query_params.get("code")) is not None:
+                performance = objects.filter(code_id=code_id).first()
+            elif (user_id := request.query_params.get("user")) is not None:
+                performance = objects.filter(user_id=user_id).order_by('-mmr', '-pk').first()
+            else:
+                return Response({"ok": False, "message": "No code or user specified"},
+                                status=status.HTTP_400_BAD_REQUEST)
+        except ValueError:
+            return Response({"ok": False, "message": "Code or user ID not an integer"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if performance is None:
+            return Response({"ok": False, "message": "No ranked code found"}, status=status.HTTP_404_NOT_FOUND)
+
+        rank = objects.filter(self.ranked_above(performance)).count() + 1
+        total = objects.count()
+        above = list(objects.filter(self.ranked_above(performance)).order_by('mmr', 'pk')[:neighbours])[::-1]
+        below = objects.filter(self.ranked_below(performance)).order_by('-mmr', '-pk')[:neighbours]
+
+        context = {'request': request}
+        return Response({'rank': rank,
+                         'total': total,
+                         'percentile': round(100 * (total - rank) / total, 2),
+                         'performance': UserPerformanceSerializer(performance, context=context).data,
+                         'above': UserPerformanceSerializer(above, many=True, context=context).data,
+                         'below': UserPerformanceSerializer(below, many=True, context=context).data})
+
 
 class MatchResultViewSet(viewsets.ModelViewSet):
-    queryset = MatchResult.objects.all()
+    queryset = MatchResult.objects.order_by('-time_finished', '-pk')
+    pagination_class = KeysetPagination
     serializer_class = MatchResultSerializer
     # permission_classes = [permissions.IsAuthenticated]
 
@@ -244,6 +643,16 @@ class SettingsViewSet(viewsets.ViewSet):
                 return Response(serializer.data)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @staticmethod
+    def archive_lazily(user_codes):
+        """
+        Queues archiving of codes that were only recorded as branch metadata during ingestion, once the change that
+        enabled them is committed.
+        """
+        for code in user_codes:
+            if not code.source_code:
+                transaction.on_commit(partial(archive_enabled_code.delay, code.pk))
+
     def enable_codes(self, request, processed_ids: set = None):
         """
         Enables code instances using incoming request data.
@@ -267,6 +676,7 @@ class SettingsViewSet(viewsets.ViewSet):
         user_codes = UserCode.objects.filter(pk__in=id_queue)
         [self.check_object_permissions(request, code) for code in user_codes]
         user_codes.update(to_clone=True)
+        self.archive_lazily(user_codes)
 
         processed_ids = set.union(id_queue, processed_ids)
 
@@ -296,6 +706,7 @@ class SettingsViewSet(viewsets.ViewSet):
             code.primary = True
             code.to_clone = True
             code.save()
+            self.archive_lazily([code])
 
         except (ValueError, TypeError):
             return False, (f"Value '{request.data['primary']}' not an ID", status.HTTP_400_BAD_REQUEST)
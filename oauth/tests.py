@@ -128,7 +128,7 @@ class UtilsTest(TestCase):
 
     #
     # exchange_code_for_token
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.request')
     @mock.patch.dict(os.environ, {'GITHUB_OAUTH_CLIENT_ID': 'not_none', 'GITHUB_OAUTH_CLIENT_SECRET': 'also_not_none'})
     def test_successful_token_exchange(self, mock_post):
         response = requests.Response()
@@ -140,7 +140,7 @@ class UtilsTest(TestCase):
         exchange_result = oauth.utils.exchange_code_for_token("test_code")
         self.assertEqual(exchange_result, {})
 
-    @mock.patch('requests.post')
+    @mock.patch('requests.Session.request')
     @mock.patch.dict(os.environ, {'GITHUB_OAUTH_CLIENT_ID': 'not_none', 'GITHUB_OAUTH_CLIENT_SECRET': 'also_not_none'})
     def test_bad_code_token_exchange(self, mock_post):
         response = requests.Response()
@@ -159,7 +159,7 @@ class UtilsTest(TestCase):
 
     #
     # fetch_github_identity
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.request')
     def test_successful_get_user(self, mock_get):
         response = requests.Response()
         response.status_code = 200
@@ -170,7 +170,7 @@ class UtilsTest(TestCase):
         exchange_result = oauth.utils.fetch_github_identity({"access_token": "test_token"})
         self.assertEqual(exchange_result, {})
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.request')
     def test_bad_token_get_user_200(self, mock_get):
         response = requests.Response()
         response.status_code = 200
@@ -181,7 +181,7 @@ class UtilsTest(TestCase):
         exchange_result = oauth.utils.fetch_github_identity({"access_token": "test_token"})
         self.assertIsNone(exchange_result)
 
-    @mock.patch('requests.get')
+    @mock.patch('requests.Session.request')
     def test_bad_token_get_user_not_200(self, mock_get):
         response = requests.Response()
         response.status_code = 401
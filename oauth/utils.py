@@ -1,11 +1,11 @@
 import json
-import requests
 import os
 from typing import Union
 
 import django.http.request
 from rest_framework.authentication import BaseAuthentication
 
+from code_manager.github import get_client
 from game_engine.models import User
 
 
@@ -23,7 +23,8 @@ def exchange_code_for_token(code: str, endpoint="https://github.com/login/oauth/
     }
     headers = {'Accept': 'application/json'}
 
-    r = requests.post(endpoint, headers=headers, data=payload)
+    # never stall a login on the API budget, GitHub answers rate limited requests with an error right away
+    r = get_client().post(endpoint, headers=headers, data=payload, wait=False)
     if r.status_code != 200 or 'error' in r.json():
         return None
 
@@ -33,8 +34,7 @@ def exchange_code_for_token(code: str, endpoint="https://github.com/login/oauth/
 
 
 def fetch_github_identity(exchange_result: dict, endpoint='https://api.github.com/user') -> Union[None, dict]:
-    headers = {'Authorization': f'token {exchange_result["access_token"]}'}
-    r = requests.get(endpoint, headers=headers)
+    r = get_client().get(endpoint, token=exchange_result["access_token"], wait=False)
     if r.status_code != 200 or 'error' in r.json():
         return None
     print(r.json())